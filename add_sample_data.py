@@ -23,10 +23,12 @@ def add_sample_data():
             "Sports"
         ]
         
+        category_ids = {}
         for category_name in categories:
             category = Category(type=category_name)
             db.session.add(category)
             db.session.commit()
+            category_ids[category_name] = category.id
             print(f"Added category: {category_name}")
         
         # Add some sample questions
@@ -73,7 +75,7 @@ def add_sample_data():
             question = Question(
                 question=q_data["question"],
                 answer=q_data["answer"],
-                category=q_data["category"],
+                category=category_ids[q_data["category"]],
                 difficulty=q_data["difficulty"]
             )
             question.insert()
@@ -0,0 +1,85 @@
+"""
+ASGI entry point: the same routes from create_app under an ASGI server.
+
+    WEB_CONCURRENCY=2 uvicorn --app-dir backend asgi:app
+
+asgiref's WsgiToAsgi does the translation. The event loop holds every
+client connection, idle or slow, and hands each request to a pool of
+``ASGI_THREADS`` threads that run the Flask app. A slow query then ties
+up one thread instead of a whole sync worker process, so a few processes
+can carry many concurrent quiz players. Keep the database pool
+(DB_POOL_SIZE + DB_MAX_OVERFLOW) near the thread count.
+
+This gives no async database access: the pinned SQLAlchemy 1.3 has no
+asyncio support, so every query runs on the sync drivers inside those
+threads. Request bodies are spooled to a temporary file before the app
+sees them and responses are streamed, so bulk import and export work
+here as they do under gunicorn, which remains the default deployment
+(see Procfile).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that runs requests on ``threads`` threads instead of one."""
+
+    def __init__(self, wsgi_application, threads=32):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        await _PooledInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+
+class _PooledInstance(WsgiToAsgiInstance):
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # asgiref runs every WSGI call on a single shared thread unless given an executor.
+        await sync_to_async(self._run_wsgi_app, thread_sensitive=False, executor=self.executor)(body)
+
+    def _run_wsgi_app(self, body):
+        """The WSGI call, in a pool thread so start_response runs there too."""
+        environ = self.build_environ(self.scope, body)
+        bytes_sent = 0
+        output = self.wsgi_application(environ, self.start_response)
+        try:
+            for chunk in output:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                if self.response_content_length is not None:
+                    # Never send more than the Content-Length the app set.
+                    chunk = chunk[:self.response_content_length - bytes_sent]
+                self.sync_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                bytes_sent += len(chunk)
+                if bytes_sent == self.response_content_length:
+                    break
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+def create_asgi_app(wsgi_app=None):
+    if wsgi_app is None:
+        from flaskr import app as wsgi_app
+    return PooledWsgiToAsgi(wsgi_app, threads=int(os.getenv('ASGI_THREADS', 32)))
+
+
+def __getattr__(name):
+    # asgi:app, built on first access like flaskr:app.
+    if name == 'app':
+        global app
+        app = create_asgi_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
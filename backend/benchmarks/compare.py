@@ -0,0 +1,62 @@
+"""
+Compare two benchmark reports written by run.py.
+
+    python benchmarks/compare.py results/abc1234.json results/def5678.json
+
+Prints the p95 latency and throughput of every result the two reports
+share, with the change from the first to the second. The exit status is 1
+when some p95 grew by more than ``--threshold`` percent, so a CI job can
+fail on regressions.
+"""
+import argparse
+import json
+import sys
+
+
+def key(result):
+    return (result['database'], result['size'], result['scenario'], result['concurrency'])
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='p95 increase in percent that counts as a regression')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    old_results = {key(result): result for result in baseline['results']}
+
+    regressions = 0
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    for result in candidate['results']:
+        old = old_results.get(key(result))
+        if old is None:
+            continue
+        p95 = change(old['p95_ms'], result['p95_ms'])
+        throughput = change(old['throughput'], result['throughput'])
+        flag = ''
+        if p95 is not None and p95 > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        database, size, scenario, concurrency = key(result)
+        print(f"{scenario:<22} {size:>8} c={concurrency:<4} "
+              f"p95 {old['p95_ms']} -> {result['p95_ms']} ms ({p95 or 0:+.1f}%)  "
+              f"{old['throughput']} -> {result['throughput']} req/s ({throughput or 0:+.1f}%)"
+              f"  [{database}]{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+A small asyncio HTTP/1.1 load generator for the benchmarks; needs no
+client library.
+
+``concurrency`` clients each keep one connection open and send requests
+back to back until ``total`` have been sent between them. Every request is
+timed from the first byte written to the last byte of the body read.
+"""
+import asyncio
+import time
+
+
+class HttpClient:
+    """One keep-alive connection to ``host:port``."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        """Send one request and return ``(status, body)``; reconnects when the server closed."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        if body is not None:
+            head += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + (body or b''))
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            await self.close()
+            return await self.request(method, path, body)
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            data = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                data += chunk[:-2]
+            data = bytes(data)
+        elif 'content-length' in headers:
+            data = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            data = await self.reader.read()
+        if headers.get('connection') == 'close' or 'content-length' not in headers and \
+                headers.get('transfer-encoding') != 'chunked':
+            await self.close()
+        return status, data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def _run(host, port, make_request, total, concurrency):
+    latencies, errors = [], 0
+    sent = 0
+
+    async def client():
+        nonlocal sent, errors
+        http = HttpClient(host, port)
+        while sent < total:
+            method, path, body = make_request(sent)
+            sent += 1
+            started = time.perf_counter()
+            try:
+                status, _ = await http.request(method, path, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                await http.close()
+                continue
+            latencies.append(time.perf_counter() - started)
+            if status >= 500:
+                errors += 1
+        await http.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_load(host, port, make_request, total=1000, concurrency=10):
+    """
+    Send ``total`` requests built by ``make_request(n) -> (method, path, body)``
+    and return throughput and latency percentiles (milliseconds).
+    """
+    latencies, errors, elapsed = asyncio.run(_run(host, port, make_request, total, concurrency))
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': _ms(percentile(latencies, 0.50)),
+        'p95_ms': _ms(percentile(latencies, 0.95)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
@@ -0,0 +1,123 @@
+"""
+Benchmark the API endpoints on synthetic question banks.
+
+    python benchmarks/run.py --sizes 10000 1000000 --concurrency 1 20 \\
+        --database-url sqlite:////tmp/bench.db \\
+        --database-url postgresql://localhost/trivia_bench
+
+For every database and bank size (smallest first, topping the same bank
+up), the app is started under gunicorn and every scenario is driven at
+every concurrency level. Each result has p50/p95/p99 latency, throughput,
+errors and the peak RSS of the server's processes. The report is written
+as JSON, named after the current commit, for ``compare.py``.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+
+from load import run_load
+from seed import seed
+from server import BACKEND, MODES, PeakRss, running
+
+WORDS = ('planet', 'river', 'empire', 'sonnet', 'glacier', 'opera', 'which')
+
+
+def scenarios(size, categories=6):
+    """Request builders by name; ``n`` is the request's sequence number."""
+    pages = max(1, size // 10)
+
+    def quiz_body(n):
+        return json.dumps({'previous_questions': [],
+                           'quiz_category': {'id': str(n % categories + 1)}}).encode()
+
+    return {
+        'questions_first_pages': lambda n: ('GET', f'/questions?page={n % 5 + 1}', None),
+        # Spread over the whole bank, so deep pages (keyset seeks) dominate.
+        'questions_any_page': lambda n: ('GET', f'/questions?page={random.randrange(pages) + 1}', None),
+        'search': lambda n: ('POST', '/questions', json.dumps(
+            {'searchTerm': random.choice(WORDS), 'page': n % 3 + 1}).encode()),
+        'category_listing': lambda n: ('GET', f'/categories/{n % categories + 1}/questions', None),
+        'categories': lambda n: ('GET', '/categories', None),
+        'quizzes': lambda n: ('POST', '/quizzes', quiz_body(n)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def redact(url):
+    """Database URL without its password."""
+    scheme, sep, rest = url.partition('://')
+    if '@' in rest:
+        credentials, host = rest.rsplit('@', 1)
+        rest = credentials.split(':', 1)[0] + ':***@' + host
+    return scheme + sep + rest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', action='append', dest='database_urls',
+                        help='repeat for several databases; defaults to a fresh SQLite file')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 20])
+    parser.add_argument('--requests', type=int, default=2000, help='per scenario and concurrency')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--mode', choices=list(MODES), default='wsgi')
+    parser.add_argument('--scenarios', nargs='+', help='default: all of them')
+    parser.add_argument('--output', help='default: benchmarks/results/<commit>.json')
+    args = parser.parse_args()
+
+    random.seed(0)
+    database_urls = args.database_urls or [f'sqlite:///{tempfile.mkdtemp()}/bench.db']
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'mode': args.mode,
+        'workers': args.workers,
+        'results': [],
+    }
+
+    for database_url in database_urls:
+        for size in sorted(args.sizes):
+            seed(database_url, size, echo=lambda message: print(message, file=sys.stderr))
+            env = dict(os.environ, DATABASE_URL=database_url)
+            with running(args.mode, args.workers, env) as (port, pid):
+                for name, make_request in scenarios(size).items():
+                    if args.scenarios and name not in args.scenarios:
+                        continue
+                    for concurrency in args.concurrency:
+                        run_load('127.0.0.1', port, make_request, args.warmup, concurrency)
+                        with PeakRss(pid) as rss:
+                            result = run_load('127.0.0.1', port, make_request, args.requests, concurrency)
+                        result.update(database=database_url.split(':', 1)[0].split('+', 1)[0],
+                                      database_url=redact(database_url), size=size, scenario=name,
+                                      peak_rss_bytes=rss.peak)
+                        report['results'].append(result)
+                        print(f"{name:<22} size={size:<8} c={concurrency:<4} "
+                              f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                              f"p99={result['p99_ms']}ms {result['throughput']} req/s",
+                              file=sys.stderr)
+
+    output = args.output or os.path.join(BACKEND, 'benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Synthetic question banks for the benchmarks.
+
+    python benchmarks/seed.py sqlite:////tmp/bench.db 100000
+
+Creates the schema if needed and tops the questions table up to the
+requested size with executemany batches, so re-seeding an existing bank is
+cheap. Question text is varied enough for search to have real work to do.
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, select  # noqa: E402
+
+from models import db, Category, Question, rebuild_question_counts  # noqa: E402
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = ('planet river painter empire treaty album striker element canyon sonnet '
+         'orbit harbor sculpture dynasty volcano tenor marathon molecule glacier '
+         'fresco senate reef meteor opera relay enzyme delta mosaic').split()
+BATCH_SIZE = 10000
+
+
+def seed(database_url, size, batch_size=BATCH_SIZE, echo=print):
+    """Make sure ``database_url`` holds at least ``size`` questions; returns the engine."""
+    engine = create_engine(database_url)
+    db.metadata.create_all(engine)
+    categories, questions = Category.__table__, Question.__table__
+
+    with engine.begin() as conn:
+        category_ids = [row[0] for row in conn.execute(select([categories.c.id]))]
+        if not category_ids:
+            conn.execute(categories.insert(), [{'type': name} for name in CATEGORIES])
+            category_ids = [row[0] for row in conn.execute(select([categories.c.id]))]
+        existing = conn.execute(select([func.count(questions.c.id)])).scalar()
+
+    rng = random.Random(size)
+    for start in range(existing, size, batch_size):
+        rows = [{'question': f"Question {n}: which {' '.join(rng.sample(WORDS, 4))}?",
+                 'answer': rng.choice(WORDS),
+                 'category': rng.choice(category_ids),
+                 'difficulty': rng.randint(1, 5)}
+                for n in range(start, min(start + batch_size, size))]
+        with engine.begin() as conn:
+            conn.execute(questions.insert(), rows)
+        echo(f"  seeded {start + len(rows)} of {size} questions")
+
+    # The rows above bypassed the app's counters; recount them.
+    with engine.begin() as conn:
+        rebuild_question_counts(conn)
+    return engine
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('database_url')
+    parser.add_argument('size', type=int)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    seed(args.database_url, args.size, args.batch_size)
@@ -0,0 +1,107 @@
+"""
+Start the app under gunicorn (WSGI) or uvicorn (ASGI) for a benchmark run,
+and watch the memory of its processes.
+"""
+import contextlib
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'wsgi': lambda workers, port: ['gunicorn', '--chdir', BACKEND, '--workers', str(workers),
+                                   '--config', os.path.join(BACKEND, 'gunicorn.conf.py'),
+                                   '--bind', f'127.0.0.1:{port}', 'flaskr:app'],
+    'asgi': lambda workers, port: ['uvicorn', '--app-dir', BACKEND, '--workers', str(workers),
+                                   '--host', '127.0.0.1', '--port', str(port), 'asgi:app'],
+}
+
+
+class ServerUnavailable(Exception):
+    pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+@contextlib.contextmanager
+def running(mode, workers, env, port=None):
+    """Run the app in ``mode`` until the block exits; yields ``(port, pid)``."""
+    port = port or free_port()
+    command = MODES[mode](workers, port)
+    if shutil.which(command[0]) is None:
+        raise ServerUnavailable(f'{command[0]} is not installed')
+
+    # The app shares its caches between workers when it knows there are several.
+    env = dict(env, WEB_CONCURRENCY=str(workers))
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        yield port, server.pid
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def tree_rss(pid):
+    """Resident bytes of ``pid`` and its descendants, from /proc; None elsewhere."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            if current == pid:
+                return None
+    return total
+
+
+class PeakRss:
+    """Samples ``tree_rss(pid)`` every ``interval`` seconds while in use; ``peak`` is the maximum."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while True:
+            rss = tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.interval):
+                return
@@ -0,0 +1,64 @@
+"""
+Compare the sync WSGI deployment (gunicorn, as in the Procfile) with the
+ASGI entry point (asgi.py under uvicorn) on the same database.
+
+    python benchmarks/server_modes.py --questions 10000 --concurrency 200
+
+Each mode is started as a subprocess with the same number of worker
+processes and driven with the same request mix; modes whose server is not
+installed are reported as skipped. Results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from load import run_load
+from seed import seed
+from server import MODES, ServerUnavailable, running
+
+SCENARIOS = {
+    'questions': lambda n: ('GET', f'/questions?page={n % 50 + 1}', None),
+    'quizzes': lambda n: ('POST', '/quizzes', json.dumps(
+        {'previous_questions': [], 'quiz_category': {'id': str(n % 6 + 1)}}).encode()),
+}
+
+
+def bench_mode(mode, args, env):
+    try:
+        with running(mode, args.workers, env, args.port) as (port, pid):
+            results = {}
+            for name, make_request in SCENARIOS.items():
+                run_load('127.0.0.1', port, make_request, total=args.warmup, concurrency=args.concurrency)
+                results[name] = run_load('127.0.0.1', port, make_request,
+                                         total=args.requests, concurrency=args.concurrency)
+            return results
+    except ServerUnavailable as e:
+        return {'skipped': str(e)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file')
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    database_url = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+    seed(database_url, args.questions, echo=lambda message: print(message, file=sys.stderr))
+    env = dict(os.environ, DATABASE_URL=database_url)
+
+    report = {'questions': args.questions, 'workers': args.workers,
+              'modes': {mode: bench_mode(mode, args, env) for mode in args.modes}}
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Caches for the read endpoints, stored in a cache backend (see
+cache_backends.py) so every worker sharing the backend shares the entries
+and sees the same version stamps.
+"""
+import functools
+import hashlib
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+from models import Category, on_category_change, on_question_change, on_questions_reloaded
+from replicas import primary_reads
+from serialization import dumps, loads
+
+CATEGORIES_VERSION = 'categories'
+DATA_VERSION = 'data'
+# Bumped by bulk writes, which do not say which categories they touched.
+RELOAD_VERSION = 'reload'
+
+CachedCategories = namedtuple('CachedCategories', 'version categories body etag expires')
+CachedResponse = namedtuple('CachedResponse', 'version body etag')
+
+
+class CategoryCache:
+    """
+    The ``{id: type}`` category map, the serialized GET /categories body and
+    its ETag. The body is shared through the backend under the current
+    categories version; each worker also keeps the parsed map and only
+    checks the version stamp while it is younger than ``ttl`` seconds.
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self._entry = None
+
+    @property
+    def version(self):
+        return self.backend.version(CATEGORIES_VERSION)
+
+    def get(self):
+        version = self.version
+        entry = self._entry
+        if entry is None or entry.version != version or entry.expires < time.monotonic():
+            entry = self._entry = self._load(version)
+        return entry
+
+    def invalidate(self):
+        self.backend.bump(CATEGORIES_VERSION)
+
+    def _load(self, version):
+        key = f'categories:{version}'
+        body = self.backend.get(key)
+        if body is None:
+            with primary_reads():
+                categories = {str(category.id): category.type
+                              for category in Category.query.order_by(Category.id)}
+            body = dumps({"success": True, "categories": categories}) + b'\n'
+            self.backend.set(key, body, ttl=self.ttl)
+        else:
+            categories = loads(body)['categories']
+
+        return CachedCategories(version, categories, body, hashlib.sha1(body).hexdigest(),
+                                time.monotonic() + self.ttl)
+
+
+def category_scope(category_id):
+    """Version stamp bumped by writes to the questions of ``category_id``, or to it."""
+    return f'category:{category_id}'
+
+
+class ResponseCache:
+    """
+    Serialized JSON bodies of GET endpoints keyed on path, query string and
+    the data version. Every question or category write bumps the version,
+    so everything cached before it misses from then on and ages out of the
+    backend. Endpoints cached with a ``scope`` are versioned by that stamp
+    instead, and survive writes elsewhere. Hit and miss counters are per
+    worker.
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self.backend.version(DATA_VERSION)
+
+    def bump(self):
+        self.backend.bump(DATA_VERSION)
+
+    def scope_version(self, scope):
+        return f'{self.backend.version(RELOAD_VERSION)}.{self.backend.version(scope)}'
+
+    def get(self, key, version):
+        value = self.backend.get(f'response:{version}:{key}')
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # The first 40 bytes are the hex sha1 ETag.
+        return CachedResponse(version, value[40:], value[:40].decode('ascii'))
+
+    def put(self, key, version, body):
+        entry = CachedResponse(version, body, hashlib.sha1(body).hexdigest())
+        self.backend.set(f'response:{version}:{key}', entry.etag.encode('ascii') + body, ttl=self.ttl)
+        return entry
+
+    def stats(self):
+        return dict(self.backend.stats(), hits=self.hits, misses=self.misses, version=self.version)
+
+    def cached(self, view=None, *, scope=None, when=None):
+        """
+        Serve ``view`` from the cache. Only 200 responses are stored; every
+        reply gets a strong ETag and honours If-None-Match. Misses run on the
+        primary database, never a read replica. ``scope(**view_args)``
+        names the version stamp of the entry (see ``category_scope``); requests
+        for which ``when()`` is false bypass the cache.
+        """
+        if view is None:
+            return functools.partial(self.cached, scope=scope, when=when)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if when is not None and not when():
+                return view(*args, **kwargs)
+            key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+            version = self.version if scope is None else self.scope_version(scope(**kwargs))
+            entry = self.get(key, version)
+            status = 'HIT'
+            if entry is None:
+                status = 'MISS'
+                # Filled from the primary: a lagging replica would store stale
+                # data under the version a write has just bumped.
+                with primary_reads():
+                    response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = self.put(key, version, response.get_data())
+
+            response = current_app.response_class(entry.body, mimetype='application/json')
+            response.set_etag(entry.etag)
+            response.cache_control.no_cache = True
+            response.headers['X-Cache'] = status
+            return response.make_conditional(request)
+        return wrapper
+
+
+@on_category_change
+def _invalidate_categories(action, category, previous):
+    cache = current_app.extensions.get('categories')
+    if cache is not None:
+        cache.invalidate()
+    _bump_data_version()
+    _bump_category_versions(category['id'])
+
+
+@on_question_change
+def _invalidate_responses(action, question, previous):
+    _bump_data_version()
+    # An update that moves a question changes its old category too.
+    _bump_category_versions(question['category'], previous.get('category'))
+
+
+@on_questions_reloaded
+def _invalidate_reloaded_responses():
+    _bump_data_version()
+    responses = current_app.extensions.get('responses')
+    if responses is not None:
+        responses.backend.bump(RELOAD_VERSION)
+
+
+def _bump_category_versions(*category_ids):
+    responses = current_app.extensions.get('responses')
+    if responses is None:
+        return
+    for category_id in {str(category_id) for category_id in category_ids if category_id is not None}:
+        responses.backend.bump(category_scope(category_id))
+
+
+def _bump_data_version():
+    responses = current_app.extensions.get('responses')
+    if responses is not None:
+        responses.bump()
@@ -0,0 +1,374 @@
+"""
+Storage behind the app's caches (categories, listing pages, quiz decks).
+
+Every backend stores bytes under string keys with an optional TTL, and keeps
+named version stamps that the caches put into their keys. Bumping a stamp
+retires everything cached under the old one, in every worker that shares
+the backend.
+
+* ``local://``           - one LRU per process, bounded by ``max_bytes``.
+* ``shm:///dev/shm/dir``  - files in a (RAM-backed) directory shared by every
+                           worker on the host; version stamps live in an
+                           mmap'd slot table.
+* ``redis://host:port/db`` - any server speaking the Redis protocol.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from urllib.parse import urlparse
+
+
+class CacheFull(Exception):
+    """A non-evicting LocalCacheBackend has no room left for a value."""
+
+
+class LocalCacheBackend:
+    """
+    Per-process LRU; fast, but every gunicorn worker holds its own copy.
+    With ``evict=False`` nothing is dropped before it expires: when full,
+    expired entries are swept and a write that still does not fit raises
+    CacheFull.
+    """
+    name = 'local'
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, evict=True):
+        self.max_bytes = max_bytes
+        self.evict = evict
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def getrange(self, key, start, length):
+        value = self.get(key)
+        return None if value is None else value[start:start + length]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, _expires(ttl), value)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def incr(self, key, ttl=None):
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            expires = self._entries[key][0] if key in self._entries else _expires(ttl)
+            self._store(key, expires, str(value).encode('ascii'))
+            return value
+
+    def version(self, name):
+        return self._versions.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            return self._versions[name]
+
+    def stats(self):
+        return {'backend': self.name, 'entries': len(self._entries), 'bytes': self._bytes}
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _store(self, key, expires, value):
+        self._pop(key)
+        if len(value) > self.max_bytes:
+            if not self.evict:
+                raise CacheFull(key)
+            return
+        self._entries[key] = (expires, value)
+        self._bytes += len(value)
+        if self._bytes <= self.max_bytes:
+            return
+        if self.evict:
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+            return
+        now = time.time()
+        for expired in [k for k, (at, _) in self._entries.items() if at is not None and at < now]:
+            self._pop(expired)
+        if self._bytes > self.max_bytes:
+            self._pop(key)
+            raise CacheFull(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+class SharedMemoryCacheBackend:
+    """
+    Workers on one host share ``path`` (put it on tmpfs, e.g. /dev/shm).
+    Each value is a file holding its expiry time then its bytes, replaced
+    atomically on write; expired files are swept every ``SWEEP_EVERY``
+    writes. Version stamps are 8-byte counters in an mmap'd table of
+    ``VERSION_SLOTS`` slots, incremented under an flock. Two names sharing
+    a slot only cause extra misses.
+    """
+    name = 'shm'
+    HEADER = struct.Struct('!d')
+    VERSION_SLOTS = 1024
+    SWEEP_EVERY = 1024
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.join(path, 'values'), exist_ok=True)
+        versions = os.path.join(path, 'versions')
+        self._versions_fd = os.open(versions, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.VERSION_SLOTS * 8
+        if os.fstat(self._versions_fd).st_size < size:
+            os.ftruncate(self._versions_fd, size)
+        self._versions = mmap.mmap(self._versions_fd, size)
+        self._writes = 0
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        if self._expired(value):
+            return None
+        return value[self.HEADER.size:]
+
+    def getrange(self, key, start, length):
+        try:
+            with open(self._file(key), 'rb') as f:
+                if self._expired(f.read(self.HEADER.size)):
+                    return None
+                f.seek(self.HEADER.size + start)
+                return f.read(length)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires = _expires(ttl)
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.path, 'values'))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.HEADER.pack(expires or 0) + value)
+        os.replace(tmp, self._file(key))
+
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self._sweep()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key, ttl=None):
+        with open(os.path.join(self.path, 'incr.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            value = int(self.get(key) or 0) + 1
+            self.set(key, str(value).encode('ascii'), ttl)
+            return value
+
+    def version(self, name):
+        return struct.unpack_from('!q', self._versions, self._slot(name))[0]
+
+    def bump(self, name):
+        offset = self._slot(name)
+        fcntl.flock(self._versions_fd, fcntl.LOCK_EX)
+        try:
+            value = struct.unpack_from('!q', self._versions, offset)[0] + 1
+            struct.pack_into('!q', self._versions, offset, value)
+            return value
+        finally:
+            fcntl.flock(self._versions_fd, fcntl.LOCK_UN)
+
+    def stats(self):
+        return {'backend': self.name, 'path': self.path}
+
+    def _file(self, key):
+        return os.path.join(self.path, 'values', hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _slot(self, name):
+        return zlib.crc32(name.encode('utf-8')) % self.VERSION_SLOTS * 8
+
+    def _expired(self, value):
+        expires = self.HEADER.unpack_from(value)[0]
+        return expires and expires < time.time()
+
+    def _sweep(self):
+        directory = os.path.join(self.path, 'values')
+        now = time.time()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    header = f.read(self.HEADER.size)
+                if len(header) == self.HEADER.size and 0 < self.HEADER.unpack(header)[0] < now:
+                    os.unlink(path)
+            except (FileNotFoundError, IsADirectoryError):
+                pass
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCacheBackend:
+    """
+    Speaks just enough of the Redis protocol (RESP) for the cache, over one
+    socket per process, so it needs no client library. Reconnects after a
+    fork or a dropped connection.
+    """
+    name = 'redis'
+    VERSION_PREFIX = 'version:'
+
+    def __init__(self, host='localhost', port=6379, db=0, timeout=1.0):
+        self.host, self.port, self.db, self.timeout = host, port, db, timeout
+        self._sock = None
+        self._file = None
+        self._pid = None
+        self._lock = Lock()
+
+    def get(self, key):
+        return self.command('GET', key)
+
+    def getrange(self, key, start, length):
+        value = self.command('GETRANGE', key, start, start + length - 1)
+        # GETRANGE answers an empty string for missing keys and past the end.
+        return value or None
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.command('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self.command('SET', key, value)
+
+    def delete(self, key):
+        self.command('DEL', key)
+
+    def incr(self, key, ttl=None):
+        value = self.command('INCR', key)
+        if value == 1 and ttl:
+            self.command('PEXPIRE', key, int(ttl * 1000))
+        return value
+
+    def version(self, name):
+        return int(self.command('GET', self.VERSION_PREFIX + name) or 0)
+
+    def bump(self, name):
+        return self.command('INCR', self.VERSION_PREFIX + name)
+
+    def stats(self):
+        return {'backend': self.name, 'host': self.host, 'port': self.port}
+
+    def command(self, *args):
+        with self._lock:
+            try:
+                return self._call(args)
+            except (OSError, EOFError):
+                # Stale socket (server restart, idle timeout): retry once.
+                self._close()
+                return self._call(args)
+
+    def _call(self, args):
+        if self._sock is None or self._pid != os.getpid():
+            self._connect()
+        self._sock.sendall(_encode_command(args))
+        return self._read_reply()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile('rb')
+        self._pid = os.getpid()
+        if self.db:
+            self._sock.sendall(_encode_command(('SELECT', self.db)))
+            self._read_reply()
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._file = None
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise EOFError('connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f'unexpected reply {line!r}')
+
+
+def _encode_command(args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def _expires(ttl):
+    return time.time() + ttl if ttl else None
+
+
+def is_process_local(url):
+    """True when ``url`` names a backend that each worker process holds on its own."""
+    return urlparse(url).scheme in ('', 'local')
+
+
+def default_cache_url(workers, namespace):
+    """
+    ``local://`` for a single worker. With several, a shm:// directory
+    named after ``namespace`` (the database URL) that they all share, so a
+    write in one worker invalidates the pages and decks of the others.
+    """
+    if workers <= 1:
+        return 'local://'
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    name = 'quizmaster-' + hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:12]
+    return 'shm://' + os.path.join(root, name)
+
+
+def create_cache_backend(url, max_bytes=64 * 1024 * 1024, evict=True):
+    """Backend for ``url``: local://, shm:///path or redis://host:port/db."""
+    parsed = urlparse(url)
+    if is_process_local(url):
+        return LocalCacheBackend(max_bytes, evict=evict)
+    if parsed.scheme == 'shm':
+        return SharedMemoryCacheBackend(parsed.path or '/dev/shm/quizmaster-cache')
+    if parsed.scheme == 'redis':
+        return RedisCacheBackend(parsed.hostname or 'localhost', parsed.port or 6379,
+                                 int(parsed.path.strip('/') or 0))
+    raise ValueError(f'unknown cache backend {url!r}')
@@ -0,0 +1,61 @@
+"""
+Connection pool settings and pool health metrics.
+
+Pool sizing comes from the environment so it can be matched against the
+database's connection limit: workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+must stay below it.
+"""
+import os
+import time
+
+from sqlalchemy.pool import QueuePool
+
+from metrics import Histogram
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_wait = Histogram()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkout_wait = self.checkout_wait
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.checkout_wait.observe(time.perf_counter() - started)
+
+
+def engine_options(database_url, environ=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``database_url``, read from DB_POOL_* variables."""
+    if database_url.startswith('sqlite'):
+        # SQLite connections are per file and cheap; keep SQLAlchemy's default pool.
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes', 'on'),
+    }
+
+
+def pool_stats(engine):
+    """Connections in use and idle for this worker, with checkout waits when instrumented."""
+    pool = engine.pool
+    stats = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), in_use=pool.checkedout(), idle=pool.checkedin(),
+                     overflow=pool.overflow(), max_overflow=pool._max_overflow,
+                     timeout=pool.timeout())
+    if isinstance(pool, InstrumentedQueuePool):
+        stats['checkout_wait_seconds'] = pool.checkout_wait.snapshot()
+    return stats
@@ -0,0 +1,72 @@
+"""
+Streaming export of the question bank as NDJSON or CSV.
+
+Rows come from a server-side cursor (``stream_results`` on Postgres) read
+``BATCH_SIZE`` at a time, and are serialized into chunks of about
+``CHUNK_BYTES`` as they arrive, so memory stays flat whatever the size of
+the table. The CSV columns match what importer.py reads back.
+"""
+import csv
+import io
+import zlib
+
+import repository
+from serialization import dumps
+
+BATCH_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+FORMATS = ('ndjson', 'csv')
+COLUMNS = repository.QUESTION_FIELDS
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_rows(category=None, difficulty=None):
+    """Yield ``COLUMNS`` tuples in id order, optionally for one category and/or difficulty."""
+    criteria = []
+    if category is not None:
+        criteria.append(repository.questions.c.category == category)
+    if difficulty is not None:
+        criteria.append(repository.questions.c.difficulty == difficulty)
+    for record in repository.stream(*criteria, batch_size=BATCH_SIZE):
+        # Same shape as Question.format(): category ids are strings.
+        if record.category is not None:
+            record = record._replace(category=str(record.category))
+        yield record
+
+
+def serialize(rows, fmt):
+    """Yield the ``rows`` as encoded chunks of about ``CHUNK_BYTES``."""
+    if fmt == 'ndjson':
+        buffer = bytearray()
+        for row in rows:
+            buffer += dumps(dict(zip(COLUMNS, row)))
+            buffer += b'\n'
+            if len(buffer) >= CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= CHUNK_BYTES:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+    else:
+        raise ValueError(f'unknown export format {fmt!r}')
+
+
+def gzipped(chunks):
+    """Compress a stream of byte chunks into one gzip member."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
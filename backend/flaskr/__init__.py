@@ -1,20 +1,195 @@
+import time
+_import_started = time.perf_counter()
+
+import io
 import os
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, request, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS #, cross_origin
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, question_count, rebuild_question_counts, ensure_question_counts
+from selection import QuestionIndex
+from quiz_sessions import QuizSessionStore
+from search import create_search_backend
+from cache import CategoryCache, ResponseCache, category_scope
+from cache_backends import create_cache_backend, default_cache_url, CacheFull
+from db_pool import pool_stats
+from replicas import ReplicaRouter, primary_reads
+from importer import QuestionImporter, Checkpoint, read_rows, CHUNK_SIZE, FORMATS
+import exporter
+from serialization import jsonify
+import repository
+from instrumentation import RequestMetrics, SlowRequestProfiler
+from static_assets import StaticAssets
+import migrations
+
+# Seconds spent importing this package and its dependencies (Flask, SQLAlchemy, ...).
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 QUESTIONS_PER_PAGE = 10
+# Largest page a client may ask for with ?limit=.
+MAX_PAGE_SIZE = 100
+# Most questions one POST /quizzes may return.
+MAX_QUIZ_BATCH = 50
+TRUTHY = ('1', 'true', 'yes', 'on')
 
 def create_app(test_config=None):
+    started = time.perf_counter()
     # create and configure the app
     app = Flask(__name__, static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'), static_url_path='/static_files')
-    setup_db(app)
+    # Lean mutation replies skip the page of questions unless asked for one.
+    app.config['LEAN_MUTATION_RESPONSES'] = os.getenv('LEAN_MUTATION_RESPONSES', '').lower() in TRUTHY
+    # Lifetime in seconds of a server-side quiz session deck.
+    app.config['QUIZ_SESSION_TTL'] = int(os.getenv('QUIZ_SESSION_TTL', 3600))
+    # Questions dealt into one session deck at most, drawn at random from the category.
+    app.config['QUIZ_SESSION_MAX_QUESTIONS'] = int(os.getenv('QUIZ_SESSION_MAX_QUESTIONS', 10000))
+    # 'auto' (full text when the database supports it), 'fulltext', 'ngram' or 'substring'.
+    app.config['SEARCH_BACKEND'] = os.getenv('SEARCH_BACKEND', 'auto')
+    # Memory budget and fields of the in-memory trigram index used by 'ngram'.
+    app.config['SEARCH_NGRAM_MAX_BYTES'] = int(os.getenv('SEARCH_NGRAM_MAX_BYTES', 256 * 1024 * 1024))
+    app.config['SEARCH_NGRAM_INCLUDE_ANSWER'] = os.getenv('SEARCH_NGRAM_INCLUDE_ANSWER', '').lower() in TRUTHY
+    # Seconds before the trigram index is rebuilt to pick up other workers' writes.
+    app.config['SEARCH_NGRAM_MAX_AGE'] = int(os.getenv('SEARCH_NGRAM_MAX_AGE', 300))
+    # Seconds the category map is served from memory before it is reloaded.
+    app.config['CATEGORY_CACHE_TTL'] = int(os.getenv('CATEGORY_CACHE_TTL', 300))
+    # Worker processes serving the app. Heroku sets it, gunicorn and uvicorn default
+    # --workers to it, and gunicorn.conf.py sets it from --workers.
+    app.config['WEB_CONCURRENCY'] = int(os.getenv('WEB_CONCURRENCY', 1))
+    # Where cached categories, pages and quiz decks live: local://, shm:///path or redis://host:port/db.
+    # Unset, it is local:// for one worker and a shm:// directory shared by the workers otherwise.
+    app.config['CACHE_URL'] = os.getenv('CACHE_URL', '')
+    # Memory bound of the local:// backend, and lifetime of cached GET responses.
+    app.config['CACHE_MAX_BYTES'] = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+    # Where quiz decks live (default: CACHE_URL). Decks are never evicted before they expire;
+    # on local:// they get their own store of QUIZ_SESSION_MAX_BYTES, and a session only
+    # works in the worker that started it.
+    app.config['QUIZ_SESSION_URL'] = os.getenv('QUIZ_SESSION_URL', '')
+    app.config['QUIZ_SESSION_MAX_BYTES'] = int(os.getenv('QUIZ_SESSION_MAX_BYTES', 64 * 1024 * 1024))
+    # Write folded stacks of requests slower than this many ms (0 = profiler off), sampling
+    # every PROFILE_INTERVAL_MS ms in PROFILE_SAMPLE_RATE of requests.
+    app.config['PROFILE_SLOW_REQUEST_MS'] = int(os.getenv('PROFILE_SLOW_REQUEST_MS', 0))
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', '/tmp/quizmaster-profiles')
+    app.config['PROFILE_INTERVAL_MS'] = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', 1.0))
+    # Boot without touching the database: tables, migrations and full text indexes
+    # are left to `flask db-init`, which must have run against it.
+    app.config['SKIP_SCHEMA_CHECKS'] = os.getenv('SKIP_SCHEMA_CHECKS', '').lower() in TRUTHY
+    # Comma-separated replicas for the read-only routes, how often a down one is re-checked,
+    # and how many seconds a client's reads stay on the primary after it writes.
+    app.config['DATABASE_REPLICA_URLS'] = os.getenv('DATABASE_REPLICA_URLS', '')
+    app.config['REPLICA_CHECK_INTERVAL'] = float(os.getenv('REPLICA_CHECK_INTERVAL', 10))
+    app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+    if test_config:
+        app.config.update(test_config)
+    check_schema = not app.config['SKIP_SCHEMA_CHECKS']
+    setup_db(app, create_schema=check_schema)
+    if not app.config['CACHE_URL']:
+        app.config['CACHE_URL'] = default_cache_url(app.config['WEB_CONCURRENCY'],
+                                                    app.config['SQLALCHEMY_DATABASE_URI'])
+    cache_backend = app.extensions['cache'] = create_cache_backend(app.config['CACHE_URL'],
+                                                                   max_bytes=app.config['CACHE_MAX_BYTES'])
+    app.extensions['question_index'] = QuestionIndex(cache_backend)
+    session_backend = create_cache_backend(app.config['QUIZ_SESSION_URL'] or app.config['CACHE_URL'],
+                                           max_bytes=app.config['QUIZ_SESSION_MAX_BYTES'], evict=False)
+    app.extensions['quiz_sessions'] = QuizSessionStore(session_backend, ttl=app.config['QUIZ_SESSION_TTL'],
+                                                       max_questions=app.config['QUIZ_SESSION_MAX_QUESTIONS'])
+    app.extensions['search'] = create_search_backend(app, app.config['SEARCH_BACKEND'],
+                                                       install=check_schema)
+    app.extensions['categories'] = CategoryCache(cache_backend, ttl=app.config['CATEGORY_CACHE_TTL'])
+    response_cache = app.extensions['responses'] = ResponseCache(cache_backend, ttl=app.config['RESPONSE_CACHE_TTL'])
+    profiler = None
+    if app.config['PROFILE_SLOW_REQUEST_MS']:
+        profiler = SlowRequestProfiler(app.config['PROFILE_DIR'],
+                                       threshold=app.config['PROFILE_SLOW_REQUEST_MS'] / 1000,
+                                       interval=app.config['PROFILE_INTERVAL_MS'] / 1000,
+                                       sample_rate=app.config['PROFILE_SAMPLE_RATE'])
+    static_assets = app.extensions['static_assets'] = StaticAssets(app.static_folder)
+    replica_urls = [url.strip().replace('postgres://', 'postgresql://', 1)
+                    for url in app.config['DATABASE_REPLICA_URLS'].split(',') if url.strip()]
+    replicas = app.extensions['replicas'] = ReplicaRouter(
+        replica_urls, check_interval=app.config['REPLICA_CHECK_INTERVAL'],
+        sticky_seconds=app.config['REPLICA_STICKY_SECONDS'])
+    replicas.init_app(app, db.get_engine(app))
+    request_metrics = app.extensions['metrics'] = RequestMetrics(profiler)
+    request_metrics.init_app(app, db.get_engine(app), *replicas.engines)
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 
+    @app.cli.command('db-init')
+    def db_init_command():
+        """Create the tables, apply migrations and install the search index."""
+        db.create_all()
+        migrations.upgrade(db.engine, echo=click.echo)
+        ensure_question_counts()
+        search = app.extensions['search']
+        if search.name == 'fulltext':
+            search.install()
+        click.echo("Schema ready.")
+
+
+    @app.cli.command('rebuild-counts')
+    def rebuild_counts_command():
+        """Recompute the cached question counters from the questions table."""
+        rebuild_question_counts()
+        click.echo(f"Counted {question_count()} questions.")
+
+
+    @app.cli.command('db-upgrade')
+    @click.option('--batch-size', default=migrations.BATCH_SIZE, help='Rows copied per transaction.')
+    def db_upgrade_command(batch_size):
+        """Apply pending schema migrations."""
+        migrations.upgrade(db.engine, batch_size=batch_size, echo=click.echo)
+
+
+    @app.cli.command('db-downgrade')
+    @click.option('--to', 'target', default=0, help='Schema version to go back to.')
+    @click.option('--batch-size', default=migrations.BATCH_SIZE, help='Rows copied per transaction.')
+    def db_downgrade_command(target, batch_size):
+        """Revert schema migrations down to --to."""
+        migrations.downgrade(db.engine, target, batch_size=batch_size, echo=click.echo)
+
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS),
+                  help='Input format; guessed from the file extension by default.')
+    @click.option('--chunk-size', default=CHUNK_SIZE, help='Rows written per transaction.')
+    @click.option('--checkpoint', help='Progress file for resuming [default: SOURCE.checkpoint].')
+    def import_questions_command(source, fmt, chunk_size, checkpoint):
+        """Bulk load questions from a CSV or JSON Lines file."""
+        fmt = fmt or ('csv' if source.endswith('.csv') else 'jsonl')
+        importer = QuestionImporter(
+            chunk_size, Checkpoint(checkpoint or source + '.checkpoint', os.path.abspath(source)),
+            progress=lambda summary: click.echo(
+                "{read} rows read, {imported} imported, {duplicates} duplicates, "
+                "{rejected} rejected".format(**summary)))
+        with open(source, newline='', encoding='utf-8') as stream:
+            summary = importer.run(read_rows(stream, fmt))
+        for error in summary['errors']:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+
+
+    @app.cli.command('export-questions')
+    @click.argument('output', type=click.File('wb'), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(exporter.FORMATS), default='ndjson')
+    @click.option('--category', type=int, help='Only this category id.')
+    @click.option('--difficulty', type=int, help='Only this difficulty.')
+    @click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+    def export_questions_command(output, fmt, category, difficulty, compress):
+        """Write every question to OUTPUT (default stdout) as NDJSON or CSV."""
+        chunks = exporter.serialize(exporter.export_rows(category, difficulty), fmt)
+        for chunk in exporter.gzipped(chunks) if compress else chunks:
+            output.write(chunk)
+
+
+    @app.cli.command('precompress-static')
+    def precompress_static_command():
+        """Write .gz (and .br) files next to the built frontend assets."""
+        static_assets.precompress(echo=click.echo)
+
+
     @app.after_request
     def after_request(response):
         
@@ -26,53 +201,39 @@ def create_app(test_config=None):
 
     Serve React frontend
     """
+    def serve_asset(path):
+        response = static_assets.response(app, request, path)
+        if response is None:
+            abort(404)
+        return response
+
     @app.route('/')
     def serve_index():
-        return app.send_static_file('index.html')
+        return serve_asset('index.html')
     
     @app.route('/static/<path:path>')
     def serve_static_files(path):
-        from flask import send_from_directory
-        try:
-            # Serve from the nested static directory
-            static_dir = os.path.join(app.static_folder, 'static')
-            return send_from_directory(static_dir, path)
-        except Exception as e:
-            print(f"Error serving static file: {path}, Error: {e}")
-            abort(404)
+        # The build's hashed js/css live in the nested static directory
+        return serve_asset('static/' + path)
     
     # Serve SVG icons from the root static directory
     @app.route('/<filename>.svg')
     def serve_svg_files(filename):
-        from flask import send_from_directory
-        try:
-            print(f"🎨 SVG REQUEST: {filename}.svg from {app.static_folder}")
-            response = send_from_directory(app.static_folder, filename + '.svg')
-            response.headers['Content-Type'] = 'image/svg+xml'
-            print(f"✅ SVG SERVED: {filename}.svg")
-            return response
-        except Exception as e:
-            print(f"❌ Error serving SVG file: {filename}.svg, Error: {e}")
-            abort(404)
+        return serve_asset(filename + '.svg')
     
     # Serve other static assets (png, ico, etc.) from root static directory
     @app.route('/<filename>.png')
     def serve_png_files(filename):
-        from flask import send_from_directory
-        try:
-            return send_from_directory(app.static_folder, filename + '.png')
-        except Exception as e:
-            print(f"Error serving PNG file: {filename}.png, Error: {e}")
-            abort(404)
+        return serve_asset(filename + '.png')
     
     # Serve manifest.json and other specific files
     @app.route('/manifest.json')
     def serve_manifest():
-        return app.send_static_file('manifest.json')
+        return serve_asset('manifest.json')
     
     @app.route('/favicon.ico')
     def serve_favicon():
-        return app.send_static_file('favicon.ico')
+        return serve_asset('favicon.ico')
     
     # Catch-all route for React routes (must be last)
     @app.route('/<path:path>')
@@ -82,25 +243,23 @@ def create_app(test_config=None):
             abort(404)
         # For any other path that doesn't have an extension, serve React
         if '.' not in path:
-            return app.send_static_file('index.html')
-        else:
-            abort(404)
+            return serve_asset('index.html')
+        # Other files of the build, e.g. service-worker.js
+        return serve_asset(path)
     
     """
 
     Create an endpoint to handle GET requests for all available categories.
     """
     @app.route('/categories', methods=['GET'])
+    @replicas.read_only
     def all_categories():
-        categories = Category.query.order_by(Category.id).all()
-        categories_result = {}
-        for cat in categories:
-            categories_result[str(cat.id)] = cat.type
+        cached = app.extensions['categories'].get()
 
-        return jsonify({
-            "success": True,
-            "categories": categories_result
-        })
+        response = app.response_class(cached.body, mimetype='application/json')
+        response.set_etag(cached.etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
 
     """
 
@@ -114,42 +273,61 @@ def create_app(test_config=None):
     ten questions per page and pagination at the bottom of the screen for three pages.
     Clicking on the page numbers should update the questions.
     """
-    def paginate_questions(request, selection):
+    def paginate_questions(request, *criteria):
         """
-        HELPER FUNCTION!    
+        HELPER FUNCTION!
+        Returns the formatted page plus the cursor for the page after it.
         """
         page = request.args.get('page', 1, type=int)
-        start = (page-1) * QUESTIONS_PER_PAGE 
-        end = start + QUESTIONS_PER_PAGE
+        cursor = request.args.get('cursor')
+        per_page = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+        if not 1 <= per_page <= MAX_PAGE_SIZE:
+            abort(400)
 
-        questions = [question.format() for question in selection]
-        current_questions = questions[start:end]
-        
-        return current_questions
+        try:
+            selection, next_cursor = repository.page(*criteria, page=page, cursor=cursor,
+                                                     per_page=per_page)
+        except ValueError:
+            abort(400)
+
+        return [question.format() for question in selection], next_cursor
+
+    def mutation_response(payload, category):
+        """
+        HELPER FUNCTION!
+        Adds the new counts to a create/delete reply, plus one page of
+        questions unless the reply is lean. Lean replies still carry a page
+        when the client names one with ``page`` or ``cursor``.
+        """
+        lean = request.args.get('lean')
+        lean = app.config['LEAN_MUTATION_RESPONSES'] if lean is None else lean.lower() in TRUTHY
+
+        payload['total_questions'] = question_count()
+        payload['category_total'] = question_count(category)
+        if not lean or 'page' in request.args or 'cursor' in request.args:
+            payload['questions'], payload['next_cursor'] = paginate_questions(request)
+
+        return jsonify(payload)
     
     @app.route('/questions')
+    @replicas.read_only
+    @response_cache.cached
     def get_questions():
 
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        current_questions, next_cursor = paginate_questions(request)
 
         if not current_questions:
             abort(404)
         
-        categories = Category.query.order_by(Category.id).all()
-        categories_result = {}
-        for cat in categories:
-            categories_result[str(cat.id)] = cat.type
-
-        if len(current_questions) == 0:
-            abort(404)
+        categories_result = app.extensions['categories'].get().categories
 
         #return a list of questions, number of total questions, current category, categories.
 
         return jsonify({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(selection),
+            'total_questions': question_count(),
+            'next_cursor': next_cursor,
             'current_category': None,
             'categories': categories_result
         })
@@ -169,17 +347,13 @@ def create_app(test_config=None):
         if question is None:
             abort(404)
 
+        category = question.category
         question.delete()
 
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
-
-        return jsonify({
+        return mutation_response({
             'success':True,
-            'deleted':question_id,
-            'questions':current_questions,
-            'total_questions': len(selection)
-        })
+            'deleted':question_id
+        }, category)
 
     """
 
@@ -213,13 +387,20 @@ def create_app(test_config=None):
         # SEARCHING
         
         if search_term:
-            questions = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
+            replicas.route_reads()
+            page = body.get('page', request.args.get('page', 1, type=int))
+            if not isinstance(page, int) or page < 1:
+                abort(400)
+
+            questions, total = app.extensions['search'].search(search_term, page=page,
+                                                               per_page=QUESTIONS_PER_PAGE)
             formatted_questions = [q.format() for q in questions]
 
             return jsonify({
                 "success": True,
                 "questions": formatted_questions,
-                "total_questions": len(questions),
+                "total_questions": total,
+                "page": page,
                 "current_category": None
             })
         
@@ -232,21 +413,52 @@ def create_app(test_config=None):
         
         if not all([new_question, new_answer, new_category, new_difficulty]):
             abort(400)
+
+        if str(new_category) not in app.extensions['categories'].get().categories:
+            abort(422)
         
         question = Question(question=new_question, answer=new_answer, category=new_category, difficulty=int(new_difficulty))
 
         question.insert()
 
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        return mutation_response({
+            'success' : True,
+            'created' : question.id
+        }, new_category)
+
+    @app.route('/questions/export')
+    def export_questions():
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in exporter.FORMATS:
+            abort(400)
 
+        rows = exporter.export_rows(request.args.get('category', type=int),
+                                    request.args.get('difficulty', type=int))
+        chunks = exporter.serialize(rows, fmt)
+        compress = request.args.get('gzip', '').lower() in TRUTHY
+        if compress:
+            chunks = exporter.gzipped(chunks)
+
+        # No Content-Length, so the body goes out with chunked transfer encoding.
+        response = app.response_class(stream_with_context(chunks), mimetype=exporter.MIMETYPES[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename=questions.{fmt}'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
 
-        return jsonify({
-            'success' : True,
-            'created' : question.id,
-            'questions' : current_questions,
-            'total_questions' : len(selection)
-        })
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        fmt = request.args.get('format')
+        if fmt is None:
+            fmt = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+        if fmt not in FORMATS:
+            abort(400)
+
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        chunk_size = request.args.get('chunk_size', CHUNK_SIZE, type=int)
+        summary = QuestionImporter(chunk_size).run(read_rows(stream, fmt))
+
+        return jsonify(dict(summary, success=True, total_questions=question_count()))
 
     """
 
@@ -256,16 +468,26 @@ def create_app(test_config=None):
     categories in the left column will cause only questions of that
     category to be shown.
     """
+    def first_page():
+        return 'cursor' not in request.args and request.args.get('page', 1, type=int) == 1
+
+    # The first page of a category is the common click; it stays cached until
+    # that category or one of its questions changes.
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @replicas.read_only
+    @response_cache.cached(scope=category_scope, when=first_page)
     def get_questions_by_category_id(category_id):
-        category = Category.query.get_or_404(category_id)
+        if str(category_id) not in app.extensions['categories'].get().categories:
+            abort(404)
 
-        questions = Question.query.filter(Question.category == category_id).all()
-        formatted_questions = [question.format() for question in questions]
+        formatted_questions, next_cursor = paginate_questions(request, Question.category == category_id)
+        if not formatted_questions and not first_page():
+            abort(404)
 
         return jsonify({
             "questions": formatted_questions,
-            "total_questions": len(formatted_questions),
+            "total_questions": question_count(category_id),
+            "next_cursor": next_cursor,
             "current_category": category_id
         })
 
@@ -281,36 +503,191 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
 
+    def quiz_category_id(body):
+        """
+        HELPER FUNCTION!
+        Reads quiz_category as sent by the Play tab; 0 means every category.
+        """
+        quiz_category = body.get("quiz_category")
+        if isinstance(quiz_category, dict):
+            return int(quiz_category.get("id", 0))
+        elif quiz_category in (None, "", "0"):
+            return 0
+        else:
+            return int(quiz_category)
+
+    def quiz_difficulties(body):
+        """
+        HELPER FUNCTION!
+        ``difficulty`` is one level or an inclusive ``[low, high]`` range;
+        None means every level.
+        """
+        difficulty = body.get("difficulty")
+        if difficulty is None:
+            return None
+        if isinstance(difficulty, int) and not isinstance(difficulty, bool):
+            return range(difficulty, difficulty + 1)
+        if (isinstance(difficulty, list) and len(difficulty) == 2
+                and all(isinstance(level, int) and not isinstance(level, bool) for level in difficulty)
+                and difficulty[0] <= difficulty[1]):
+            return range(difficulty[0], difficulty[1] + 1)
+        abort(400)
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    def create_quiz_session():
+        body = request.get_json(force=True, silent=True) or {}
+        deck = app.extensions['question_index'].ids(quiz_category_id(body), quiz_difficulties(body))
+        try:
+            token, total = app.extensions['quiz_sessions'].start(deck)
+        except CacheFull:
+            # Every live deck is kept until it expires; there is no room for another.
+            abort(503)
+
+        return jsonify({
+            "success": True,
+            "session": token,
+            "total_questions": total
+        })
+
+    def quiz_batch_size(body):
+        """
+        HELPER FUNCTION!
+        ``count`` asks for several questions at once; None means one.
+        """
+        count = body.get("count")
+        if count is not None and (not isinstance(count, int) or not 1 <= count <= MAX_QUIZ_BATCH):
+            abort(400)
+        return count
+
+    def quiz_reply(payload, questions, count):
+        """
+        HELPER FUNCTION!
+        One question under ``question``, or a batch under ``questions``.
+        """
+        if count is None:
+            payload["question"] = questions[0].format() if questions else None
+        else:
+            payload["questions"] = [question.format() for question in questions]
+        return jsonify(payload)
+
+    def draw_from_session(token, count):
+        """
+        HELPER FUNCTION!
+        One round of a quiz session: pop ids until enough still exist.
+        """
+        sessions = app.extensions['quiz_sessions']
+        wanted = count or 1
+        questions = []
+        remaining = 0
+        while len(questions) < wanted:
+            ids = []
+            while len(ids) < wanted - len(questions):
+                try:
+                    question_id, remaining = sessions.draw(token)
+                except KeyError:
+                    abort(404)
+                except CacheFull:
+                    abort(503)
+                if question_id is None:
+                    break
+                ids.append(question_id)
+            if not ids:
+                break
+            questions.extend(repository.by_ids(ids))
+
+        return quiz_reply({
+            "success": True,
+            "session": token,
+            "remaining": remaining
+        }, questions, count)
+
     @app.route("/quizzes", methods=["POST"])
+    @replicas.read_only
     def create_quizzes():
         body = request.get_json(force=True, silent=True) or {}
+        count = quiz_batch_size(body)
+        if body.get("session"):
+            return draw_from_session(body["session"], count)
         if "previous_questions" not in body:
             abort(400)
-        #previous_questions = body.get("previous_questions", [])
         previous_questions = body["previous_questions"]
-        
-        quiz_category = body.get("quiz_category")
-        if isinstance(quiz_category, dict):
-            category_id = int(quiz_category.get("id", 0))
-            
-        elif quiz_category in (None, "", "0"):
-            category_id = 0
-        else:
-            category_id = int(quiz_category)
+        category_id = quiz_category_id(body)
+        difficulties = quiz_difficulties(body)
+        ramp = bool(body.get("ramp"))
 
-        query = Question.query.filter(~Question.id.in_(previous_questions))
-        if category_id:
-            query = query.filter(Question.category == str(category_id))
+        try:
+            excluded = {int(question_id) for question_id in previous_questions}
+        except (TypeError, ValueError):
+            abort(400)
 
-        questions = query.all()
-        next_question = random.choice(questions).format() if questions else None
+        index = app.extensions['question_index']
+        wanted = count or 1
+        questions = []
+        while len(questions) < wanted:
+            if ramp:
+                ids = index.sample_ramp(category_id, excluded, wanted - len(questions), difficulties,
+                                        played=len(previous_questions) + len(questions))
+            else:
+                ids = index.sample_many(category_id, excluded, wanted - len(questions), difficulties)
+            if not ids:
+                break
+            found = repository.by_ids(ids)
+            missing = set(ids) - {question.id for question in found}
+            if missing:
+                # A lagging replica may not have them yet; only the primary can tell.
+                with primary_reads():
+                    found += repository.by_ids(sorted(missing))
+                missing -= {question.id for question in found}
+            questions.extend(found)
+            excluded.update(ids)
+            for question_id in missing:
+                # Deleted by another worker since the index was built.
+                index.discard(question_id)
+
+        return quiz_reply({"success": True}, questions, count)
 
+    
+    @app.route('/cache/stats')
+    def cache_stats():
+        body = {
+            'success': True,
+            'responses': response_cache.stats(),
+            'categories_version': app.extensions['categories'].version
+        }
+        search = app.extensions['search']
+        if hasattr(search, 'stats'):
+            body['search'] = search.stats()
+        return jsonify(body)
+
+    @app.route('/pool/stats')
+    def db_pool_stats():
         return jsonify({
-            "success": True, 
-            "question": next_question
+            'success': True,
+            'pool': pool_stats(db.get_engine(app)),
+            'replicas': replicas.stats()
         })
 
-    
+    @app.route('/metrics')
+    def prometheus_metrics():
+        pool = pool_stats(db.get_engine(app))
+        responses = response_cache.stats()
+        gauges = [('response_cache_hits', 'Response cache hits in this worker.', responses['hits']),
+                  ('response_cache_misses', 'Response cache misses in this worker.', responses['misses'])]
+        for field in ('in_use', 'idle', 'overflow'):
+            if field in pool:
+                gauges.append((f'db_pool_{field}', f'Pooled database connections: {field}.', pool[field]))
+        gauges += [('boot_import_seconds', 'Seconds spent importing the app package.', boot['import_seconds']),
+                   ('boot_create_app_seconds', 'Seconds spent in create_app.', boot['create_app_seconds'])]
+        search = app.extensions['search']
+        index = search.stats() if hasattr(search, 'stats') else {}
+        if index.get('last_build_seconds') is not None:
+            gauges += [('search_index_build_seconds', 'Seconds the last trigram index build took.',
+                        index['last_build_seconds']),
+                       ('search_index_bytes', 'Estimated memory held by the trigram index.',
+                        index['estimated_bytes'])]
+        return app.response_class(request_metrics.render(gauges),
+                                  mimetype='text/plain; version=0.0.4')
+
     """
 
     Create error handlers for all expected errors
@@ -352,6 +729,15 @@ def create_app(test_config=None):
             }), 405 
     
     
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify ({
+            "success":False,
+            "error":503,
+            "message":'Service Unavailable, try again later'
+        }), 503
+
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return jsonify ({
@@ -360,8 +746,22 @@ def create_app(test_config=None):
             "message":'Internal Server Error'
         }), 500
     
-    
+
+    boot = app.extensions['boot'] = {
+        'pid': os.getpid(),
+        'import_seconds': round(IMPORT_SECONDS, 4),
+        'create_app_seconds': round(time.perf_counter() - started, 4),
+    }
+    app.logger.info('Imported in %.3fs, app created in %.3fs (pid %d).',
+                    boot['import_seconds'], boot['create_app_seconds'], boot['pid'])
     return app
 
-# Create the app instance for Gunicorn
-app = create_app()
+
+def __getattr__(name):
+    # The app instance for Gunicorn (flaskr:app), built on first access so that
+    # importing create_app alone does not build (and connect) a second app.
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,46 @@
+"""
+Gunicorn settings. Pass them with ``--config backend/gunicorn.conf.py``:
+gunicorn looks for its default ``./gunicorn.conf.py`` before ``--chdir``
+applies, so from the repository root this file is otherwise never read.
+
+With ``--preload`` the master imports the app once and workers are forked
+from it already built, so a new worker serves its first request without
+re-importing Flask and SQLAlchemy. Database connections must not cross
+the fork: the master drops its pool before forking, and each worker drops
+whatever it inherited before opening its own.
+"""
+import os
+from urllib.parse import urlparse
+
+
+def nworkers_changed(server, new_value, old_value):
+    # Runs before the app is loaded, in the master and so for every worker:
+    # with more than one, the app picks a cache they can all share.
+    os.environ['WEB_CONCURRENCY'] = str(new_value)
+
+
+def on_starting(server):
+    for name in ('CACHE_URL', 'QUIZ_SESSION_URL'):
+        url = os.getenv(name, '')
+        if server.cfg.workers > 1 and url and urlparse(url).scheme in ('', 'local'):
+            server.log.warning('%s=%s keeps a copy in each of the %d workers: a write in one '
+                               'does not reach the others, and a quiz session only works in '
+                               'the worker that started it. Leave it unset or use shm:// or '
+                               'redis://.', name, url, server.cfg.workers)
+
+
+def _dispose_engine():
+    from flaskr import app
+    from models import db
+    db.get_engine(app).dispose()
+    app.extensions['replicas'].dispose()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        _dispose_engine()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        _dispose_engine()
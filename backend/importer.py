@@ -0,0 +1,199 @@
+"""
+Bulk question import from CSV or JSON Lines.
+
+Rows are read one at a time from the input stream, validated in chunks of
+``chunk_size`` and written with a single multi-row statement per chunk
+(COPY on Postgres with psycopg2, executemany elsewhere), one transaction
+per chunk. Memory holds the current chunk and a 64-bit hash of every
+question in the bank and the input, kept as ints in a set: about 70
+bytes per question, so 70 MB for a million.
+
+Each row needs ``question``, ``answer``, ``category`` and ``difficulty``.
+``category`` is a category id or name (any case). Questions whose text,
+ignoring case and spacing, is already in the bank or earlier in the input
+are skipped as duplicates.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+from collections import Counter
+from itertools import islice
+
+from models import db, Category, Question, add_question_counts, report_questions_reloaded
+
+CHUNK_SIZE = 5000
+FORMATS = ('csv', 'jsonl')
+# Rejected rows listed in the summary; the rest are only counted.
+MAX_REPORTED_ERRORS = 100
+
+
+def read_rows(stream, fmt):
+    """Yield one dict per record of the text ``stream``, in ``fmt`` ('csv' or 'jsonl')."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+    else:
+        raise ValueError(f'unknown import format {fmt!r}')
+
+
+def question_hash(text):
+    normalized = ' '.join(text.split()).casefold()
+    return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class Checkpoint:
+    """Rows of ``source`` already committed, kept in a small JSON file at ``path``."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return 0
+        return saved['rows'] if saved.get('source') == self.source else 0
+
+    def save(self, rows):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'source': self.source, 'rows': rows}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class QuestionImporter:
+    """
+    Validates and inserts rows chunk by chunk. ``progress(summary)`` is
+    called after every committed chunk; with a ``checkpoint`` the import
+    resumes after the last committed row when run again on the same source.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, checkpoint=None, progress=None):
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.summary = {'read': 0, 'imported': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+
+    def run(self, rows):
+        """Import ``rows`` (an iterable of dicts) and return the summary."""
+        categories = self._categories()
+        seen = {question_hash(text) for (text,) in
+                db.session.query(Question.question).yield_per(10000) if text}
+        db.session.commit()
+
+        skip = self.checkpoint.load() if self.checkpoint else 0
+        self.summary['read'] = skip
+        rows = islice(rows, skip, None)
+
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                valid = []
+                for row in chunk:
+                    self.summary['read'] += 1
+                    record = self._validate(row, categories)
+                    if record is None:
+                        continue
+                    digest = question_hash(record['question'])
+                    if digest in seen:
+                        self.summary['duplicates'] += 1
+                        continue
+                    seen.add(digest)
+                    valid.append(record)
+
+                if valid:
+                    self._write(valid)
+                db.session.commit()
+                self.summary['imported'] += len(valid)
+                if self.checkpoint:
+                    self.checkpoint.save(self.summary['read'])
+                if self.progress:
+                    self.progress(self.summary)
+        finally:
+            # Tell the indexes even when the import stops halfway, so the
+            # committed chunks are seen.
+            if self.summary['imported']:
+                db.session.rollback()
+                report_questions_reloaded()
+
+        if self.checkpoint:
+            self.checkpoint.clear()
+        return self.summary
+
+    @staticmethod
+    def _categories():
+        categories = {}
+        for category in Category.query:
+            categories[str(category.id)] = category.id
+            categories[category.type.casefold()] = category.id
+        return categories
+
+    def _validate(self, row, categories):
+        line = self.summary['read']
+        if not isinstance(row, dict):
+            return self._reject(line, 'not a JSON object')
+
+        question, answer = row.get('question'), row.get('answer')
+        if not isinstance(question, str) or not isinstance(answer, str):
+            return self._reject(line, 'question and answer must be text')
+        question, answer = question.strip(), answer.strip()
+        if not question or not answer:
+            return self._reject(line, 'question and answer are required')
+
+        category = row.get('category')
+        if isinstance(category, bool) or not isinstance(category, (str, int)):
+            return self._reject(line, f"unknown category {category!r}")
+        category = categories.get(str(category).strip().casefold())
+        if category is None:
+            return self._reject(line, f"unknown category {row.get('category')!r}")
+
+        difficulty = row.get('difficulty')
+        if isinstance(difficulty, bool) or not isinstance(difficulty, (str, int)):
+            return self._reject(line, f"difficulty {difficulty!r} is not a number")
+        try:
+            difficulty = int(difficulty)
+        except ValueError:
+            return self._reject(line, f"difficulty {difficulty!r} is not a number")
+
+        return {'question': question, 'answer': answer,
+                'category': category, 'difficulty': difficulty}
+
+    def _reject(self, line, reason):
+        self.summary['rejected'] += 1
+        if len(self.summary['errors']) < MAX_REPORTED_ERRORS:
+            self.summary['errors'].append({'row': line, 'error': reason})
+        return None
+
+    @staticmethod
+    def _write(records):
+        connection = db.session.connection()
+        if connection.dialect.driver == 'psycopg2':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                (r['question'], r['answer'], r['category'], r['difficulty']) for r in records)
+            buffer.seek(0)
+            with connection.connection.cursor() as cursor:
+                cursor.copy_expert("COPY questions (question, answer, category, difficulty) "
+                                   "FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            connection.execute(Question.__table__.insert(), records)
+        # The rows bypass the mapper events; count them in the same transaction.
+        add_question_counts(connection, Counter(r['category'] for r in records))
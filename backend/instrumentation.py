@@ -0,0 +1,210 @@
+"""
+Per-request instrumentation and the opt-in sampling profiler.
+
+``RequestMetrics`` hooks before/after_request and the engine's cursor
+events to record, per route: latency, status codes, queries per request,
+time spent in queries and rows fetched (where the driver reports a row
+count, as psycopg2 does). ``render()`` writes them in the Prometheus text
+format. Numbers are per worker process; scrape each worker, or sum them.
+
+``SlowRequestProfiler`` samples the stacks of the threads serving requests
+every ``interval`` seconds. When a request runs longer than ``threshold``
+seconds its samples are written to ``directory`` as folded stacks, one
+``frame;frame;frame count`` line per distinct stack, which flamegraph.pl
+and speedscope read directly.
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from metrics import Histogram
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+PREFIX = 'quizmaster'
+
+
+class RequestMetrics:
+    """Latency, status and database counters by route, for this worker process."""
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self._lock = threading.Lock()
+        self.latency = {}       # (route, method) -> Histogram of seconds
+        self.queries = {}       # route -> Histogram of queries per request
+        self.responses = Counter()  # (route, method, status)
+        self.query_seconds = Counter()  # route
+        self.rows = Counter()   # route
+
+    def init_app(self, app, *engines):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+        g.metrics_rows = 0
+        if self.profiler is not None:
+            self.profiler.start_request()
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        with self._lock:
+            histogram = self.latency.get((route, request.method))
+            if histogram is None:
+                histogram = self.latency[(route, request.method)] = Histogram()
+            queries = self.queries.get(route)
+            if queries is None:
+                queries = self.queries[route] = Histogram(QUERY_BUCKETS)
+            self.responses[(route, request.method, response.status_code)] += 1
+            self.query_seconds[route] += g.metrics_query_seconds
+            self.rows[route] += g.metrics_rows
+        histogram.observe(elapsed)
+        queries.observe(g.metrics_queries)
+
+        if self.profiler is not None:
+            self.profiler.finish_request(f'{request.method} {route}', elapsed)
+        return response
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.metrics_query_started = time.perf_counter()
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = has_request_context() and g.pop('metrics_query_started', None)
+        if not started or 'metrics_queries' not in g:
+            return
+        g.metrics_queries += 1
+        g.metrics_query_seconds += time.perf_counter() - started
+        if not executemany and cursor.description is not None and cursor.rowcount > 0:
+            g.metrics_rows += cursor.rowcount
+
+    def render(self, extra=()):
+        """The metrics in the Prometheus text format; ``extra`` adds ``(name, help, value)`` gauges."""
+        lines = []
+        with self._lock:
+            latency = {key: histogram.snapshot() for key, histogram in self.latency.items()}
+            queries = {route: histogram.snapshot() for route, histogram in self.queries.items()}
+            responses = dict(self.responses)
+            query_seconds = dict(self.query_seconds)
+            rows = dict(self.rows)
+
+        _histogram(lines, 'request_duration_seconds', 'Request latency by route.',
+                   {(('route', route), ('method', method)): snapshot
+                    for (route, method), snapshot in latency.items()})
+        _family(lines, 'requests_total', 'counter', 'Responses by route and status.',
+                {(('route', route), ('method', method), ('status', status)): count
+                 for (route, method, status), count in responses.items()})
+        _histogram(lines, 'db_queries_per_request', 'Database queries issued by one request.',
+                   {(('route', route),): snapshot for route, snapshot in queries.items()})
+        _family(lines, 'db_query_seconds_total', 'counter', 'Time spent in database queries.',
+                {(('route', route),): seconds for route, seconds in query_seconds.items()})
+        _family(lines, 'db_rows_fetched_total', 'counter',
+                'Rows returned by queries, where the driver reports it.',
+                {(('route', route),): count for route, count in rows.items()})
+        for name, help_text, value in extra:
+            _family(lines, name, 'gauge', help_text, {(): value})
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _family(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+    lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+    for labels, value in sorted(samples.items()):
+        lines.append(f'{PREFIX}_{name}{_labels(labels)} {value}')
+
+
+def _histogram(lines, name, help_text, snapshots):
+    lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+    lines.append(f'# TYPE {PREFIX}_{name} histogram')
+    for labels, snapshot in sorted(snapshots.items()):
+        for bound, count in snapshot['buckets']:
+            le = '+Inf' if bound == 'inf' else bound
+            lines.append(f'{PREFIX}_{name}_bucket{_labels(labels + (("le", le),))} {count}')
+        lines.append(f'{PREFIX}_{name}_sum{_labels(labels)} {snapshot["sum"]}')
+        lines.append(f'{PREFIX}_{name}_count{_labels(labels)} {snapshot["count"]}')
+
+
+class SlowRequestProfiler:
+    """
+    Samples ``sample_rate`` of requests; profiles of those slower than
+    ``threshold`` seconds go to ``directory``. The sampling thread starts
+    with the first profiled request in each worker process.
+    """
+
+    def __init__(self, directory, threshold, interval=0.005, sample_rate=1.0):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self._active = {}   # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start_request(self):
+        if random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # First request in this (possibly forked) worker.
+                self._pid = os.getpid()
+                threading.Thread(target=self._sample, name='profiler', daemon=True).start()
+            self._active[threading.get_ident()] = Counter()
+
+    def finish_request(self, name, elapsed):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if stacks and elapsed >= self.threshold:
+            self._write(name, elapsed, stacks)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+    def _write(self, name, elapsed, stacks):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'\W+', '_', name).strip('_')
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                            f'{slug}-{int(elapsed * 1000)}ms.folded')
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
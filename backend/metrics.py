@@ -0,0 +1,33 @@
+"""
+Small metric primitives shared by the app's stats endpoints.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+# Seconds; roughly doubling from 1ms to 10s.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observations per upper bucket bound, plus their sum (Prometheus style)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """``{'buckets': [[bound, cumulative count], ...], 'count': n, 'sum': s}``; the last bound is 'inf'."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for bound, count in zip(self.buckets + ('inf',), counts):
+            running += count
+            cumulative.append([bound, running])
+        return {'buckets': cumulative, 'count': running, 'sum': total}
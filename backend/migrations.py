@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for the trivia database.
+
+    python migrations.py upgrade [--batch-size N] [--database-url URL]
+    python migrations.py downgrade [--to VERSION] [--batch-size N] [--database-url URL]
+
+The same steps run from ``flask db-upgrade`` / ``flask db-downgrade``.
+Applied versions are recorded in ``schema_migrations``. Row data is copied
+in primary-key batches with a commit per batch, so a live table with
+millions of rows is never locked for the whole run; on Postgres indexes are
+built CONCURRENTLY and the foreign key is validated without blocking writes.
+"""
+import argparse
+
+from sqlalchemy import (Column, Integer, MetaData, Table, create_engine,
+                        inspect, text)
+
+from models import database_path, rebuild_question_counts
+
+BATCH_SIZE = 10000
+
+metadata = MetaData()
+schema_migrations = Table('schema_migrations', metadata,
+                          Column('version', Integer, primary_key=True))
+
+
+def _backfill(engine, statement, batch_size, echo):
+    """Run ``statement`` (with :lo/:hi id bounds) over the questions table in batches."""
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT max(id) FROM questions")).scalar() or 0
+    for lo in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            conn.execute(text(statement), {'lo': lo, 'hi': lo + batch_size})
+        echo(f"  rows {lo + 1}-{min(lo + batch_size, max_id)} of {max_id}")
+
+
+def _create_index(engine, name, columns):
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY keeps the table writable but cannot run in a transaction.
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON questions ({columns})"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON questions ({columns})"))
+
+
+def _lock_questions(conn):
+    if conn.dialect.name == 'postgresql':
+        # Holds off writes between the catch-up pass and the column swap,
+        # which would otherwise lose the category of rows written in between.
+        conn.execute(text("LOCK TABLE questions IN SHARE ROW EXCLUSIVE MODE"))
+
+
+def _columns(engine):
+    return {column['name']: column['type'] for column in inspect(engine).get_columns('questions')}
+
+
+def _category_is_integer(engine):
+    return isinstance(_columns(engine)['category'], Integer)
+
+
+def _has_category_foreign_key(engine):
+    return any(key['referred_table'] == 'categories'
+               for key in inspect(engine).get_foreign_keys('questions'))
+
+
+SQLITE_STRING_QUESTIONS = """
+    CREATE TABLE IF NOT EXISTS questions_new (
+        id INTEGER NOT NULL PRIMARY KEY, question VARCHAR, answer VARCHAR,
+        category VARCHAR, difficulty INTEGER)"""
+
+
+class CategoryForeignKey:
+    """
+    questions.category: string -> integer foreign key to categories.id,
+    plus (category, id) and difficulty indexes.
+
+    The ids go into a new column first, batch by batch. A final pass picks
+    up rows written meanwhile, then the columns are swapped. Categories
+    stored by name (as old sample data did) are resolved to their id;
+    anything unresolvable becomes NULL. Every step checks what is already
+    done, so a run that was interrupted can simply be started again.
+    """
+    version = 1
+
+    def upgrade(self, engine, batch_size, echo):
+        if not _category_is_integer(engine):
+            echo("  copying category ids into questions.category_id")
+            if 'category_id' not in _columns(engine):
+                with engine.begin() as conn:
+                    conn.execute(text("ALTER TABLE questions ADD COLUMN category_id INTEGER"))
+            resolve = """
+                UPDATE questions SET category_id = COALESCE(
+                    (SELECT c.id FROM categories c WHERE CAST(c.id AS VARCHAR) = questions.category),
+                    (SELECT c.id FROM categories c WHERE c.type = questions.category))
+                WHERE {}"""
+            _backfill(engine, resolve.format("id > :lo AND id <= :hi"), batch_size, echo)
+
+            with engine.begin() as conn:
+                _lock_questions(conn)
+                conn.execute(text(resolve.format("category_id IS NULL")))
+                conn.execute(text("ALTER TABLE questions DROP COLUMN category"))
+                conn.execute(text("ALTER TABLE questions RENAME COLUMN category_id TO category"))
+
+            # The counters were kept per stored value, which may have been a
+            # category name; count again by id.
+            if 'question_counts' in inspect(engine).get_table_names():
+                with engine.begin() as conn:
+                    rebuild_question_counts(conn)
+
+        if engine.dialect.name == 'postgresql':
+            if not _has_category_foreign_key(engine):
+                with engine.begin() as conn:
+                    conn.execute(text("ALTER TABLE questions ADD CONSTRAINT questions_category_fkey "
+                                      "FOREIGN KEY (category) REFERENCES categories (id) NOT VALID"))
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE questions VALIDATE CONSTRAINT questions_category_fkey"))
+        # SQLite cannot add a foreign key to an existing table; tables
+        # created from the models carry it.
+
+        echo("  building indexes")
+        _create_index(engine, 'ix_questions_category_id', 'category, id')
+        _create_index(engine, 'ix_questions_difficulty', 'difficulty')
+
+    def downgrade(self, engine, batch_size, echo):
+        with engine.begin() as conn:
+            conn.execute(text("DROP INDEX IF EXISTS ix_questions_category_id"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_questions_difficulty"))
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text("ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_category_fkey"))
+        if not _category_is_integer(engine):
+            return
+        if engine.dialect.name == 'sqlite':
+            self._rebuild_sqlite_table(engine, batch_size, echo)
+            return
+
+        if 'category_text' not in _columns(engine):
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE questions ADD COLUMN category_text VARCHAR"))
+        echo("  copying category ids back into questions.category_text")
+        copy = "UPDATE questions SET category_text = CAST(category AS VARCHAR) WHERE {}"
+        _backfill(engine, copy.format("id > :lo AND id <= :hi"), batch_size, echo)
+
+        with engine.begin() as conn:
+            _lock_questions(conn)
+            conn.execute(text(copy.format("category_text IS NULL AND category IS NOT NULL")))
+            conn.execute(text("ALTER TABLE questions DROP COLUMN category"))
+            conn.execute(text("ALTER TABLE questions RENAME COLUMN category_text TO category"))
+
+    @staticmethod
+    def _rebuild_sqlite_table(engine, batch_size, echo):
+        # SQLite cannot drop a column named in a foreign key, so the table
+        # is copied into one without it and swapped in.
+        from search import SQLITE_FTS_TRIGGERS
+
+        echo("  copying questions into questions_new with string categories")
+        with engine.begin() as conn:
+            conn.execute(text(SQLITE_STRING_QUESTIONS))
+        copy = """
+            INSERT OR IGNORE INTO questions_new (id, question, answer, category, difficulty)
+            SELECT id, question, answer, CAST(category AS VARCHAR), difficulty
+            FROM questions WHERE {}"""
+        _backfill(engine, copy.format("id > :lo AND id <= :hi"), batch_size, echo)
+
+        with engine.begin() as conn:
+            conn.execute(text(copy.format("id NOT IN (SELECT id FROM questions_new)")))
+            conn.execute(text("DELETE FROM questions_new WHERE id NOT IN (SELECT id FROM questions)"))
+            conn.execute(text("DROP TABLE questions"))
+            conn.execute(text("ALTER TABLE questions_new RENAME TO questions"))
+            fts = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'")).first()
+            for statement in SQLITE_FTS_TRIGGERS if fts else []:
+                conn.execute(text(statement))
+
+
+MIGRATIONS = [CategoryForeignKey()]
+
+
+def current_version(engine):
+    metadata.create_all(engine)
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT max(version) FROM schema_migrations")).scalar() or 0
+
+
+def upgrade(engine, target=None, batch_size=BATCH_SIZE, echo=print):
+    """Apply every migration above the recorded version, up to ``target``."""
+    version = current_version(engine)
+    for migration in MIGRATIONS:
+        if version < migration.version and (target is None or migration.version <= target):
+            echo(f"Upgrading to {migration.version}: {migration.__class__.__name__}")
+            migration.upgrade(engine, batch_size, echo)
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(version=migration.version))
+
+
+def downgrade(engine, target=0, batch_size=BATCH_SIZE, echo=print):
+    """Revert applied migrations, newest first, down to ``target``."""
+    version = current_version(engine)
+    for migration in reversed(MIGRATIONS):
+        if target < migration.version <= version:
+            echo(f"Downgrading from {migration.version}: {migration.__class__.__name__}")
+            migration.downgrade(engine, batch_size, echo)
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.delete()
+                             .where(schema_migrations.c.version == migration.version))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('direction', choices=['upgrade', 'downgrade'])
+    parser.add_argument('--to', type=int, help='target version (downgrade defaults to 0)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--database-url', default=database_path)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    if args.direction == 'upgrade':
+        upgrade(engine, args.to, args.batch_size)
+    else:
+        downgrade(engine, args.to or 0, args.batch_size)
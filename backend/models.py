@@ -1,9 +1,13 @@
 import os
-from sqlalchemy import Column, String, Integer
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
 import json
 from dotenv import load_dotenv
 
+from db_pool import engine_options
+from replicas import RoutingSQLAlchemy, primary_reads
+
 load_dotenv() 
 
 # For Heroku: Use DATABASE_URL if available, otherwise use local settings
@@ -22,18 +26,27 @@ else:
     # Local environment - use SQLite for easier setup
     database_path = "sqlite:///trivia.db"
 
-db = SQLAlchemy()
+# Reads of read-only routes may go to a replica; see replicas.py.
+db = RoutingSQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service; create_schema=False
+    leaves table creation to `flask db-init`
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, create_schema=True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Options computed for an earlier URL are recomputed; ones the caller set are kept.
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS")
+    if not options or options is app.extensions.get("default_engine_options"):
+        options = app.extensions["default_engine_options"] = engine_options(database_path)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if create_schema:
+        db.create_all()
+        ensure_question_counts()
 
 """
 Question
@@ -41,17 +54,23 @@ Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Category listing and quiz sampling walk (category, id); the
+        # leftmost prefix also serves the foreign key.
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_difficulty', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
-        self.category = category
+        self.category = int(category)
         self.difficulty = difficulty
 
     def insert(self):
@@ -70,7 +89,8 @@ class Question(db.Model):
             'id': self.id,
             'question': self.question,
             'answer': self.answer,
-            'category': self.category,
+            # The API has always sent category ids as strings.
+            'category': None if self.category is None else str(self.category),
             'difficulty': self.difficulty
             }
 
@@ -87,8 +107,215 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
-            }
\ No newline at end of file
+            }
+
+"""
+QuestionCount
+    cached number of questions, one row for the whole bank ('*')
+    and one row per category. Kept current by the mapper events below,
+    inside the same transaction as the question write.
+"""
+TOTAL_SCOPE = '*'
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    scope = Column(String, primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, scope, total):
+        self.scope = scope
+        self.total = total
+
+
+def question_count(category=None):
+    """Number of questions overall, or in ``category`` when given."""
+    scope = TOTAL_SCOPE if category is None else str(category)
+    row = QuestionCount.query.get(scope)
+    return row.total if row else 0
+
+
+def ensure_question_counts():
+    """
+    Build the counters when the total or a category's row is missing, as in
+    a new database. Reads never rebuild; new categories get their row from
+    the insert hook below.
+    """
+    scopes = {scope for scope, in db.session.query(QuestionCount.scope)}
+    categories = {str(category_id) for category_id, in db.session.query(Category.id)}
+    if TOTAL_SCOPE in scopes and categories <= scopes:
+        return
+    try:
+        rebuild_question_counts()
+    except IntegrityError:
+        # Another worker booting at the same time built them first.
+        db.session.rollback()
+
+
+def rebuild_question_counts(connection=None):
+    """
+    Recompute every counter from the questions table in one GROUP BY, on
+    ``connection`` when given (the caller commits) or else the session.
+    """
+    if connection is None:
+        # The counts must come from the database they are written to.
+        with primary_reads():
+            rebuild_question_counts(db.session.connection())
+        db.session.commit()
+        return
+
+    questions, counts = Question.__table__, QuestionCount.__table__
+    totals = {str(category_id): 0 for category_id, in connection.execute(select([Category.__table__.c.id]))}
+    totals.update((str(category), total) for category, total in connection.execute(
+        select([questions.c.category, func.count(questions.c.id)]).group_by(questions.c.category)))
+    connection.execute(counts.delete())
+    connection.execute(counts.insert(), [{'scope': scope, 'total': total} for scope, total in totals.items()]
+                       + [{'scope': TOTAL_SCOPE, 'total': sum(totals.values())}])
+
+
+def add_question_counts(connection, added):
+    """
+    Add ``added`` ({category id: new questions}) to the counters, on the
+    caller's ``connection`` and so in the transaction that wrote the rows.
+    """
+    for category, count in added.items():
+        _adjust_counts(connection, category, count)
+
+
+def _adjust_counts(connection, category, delta):
+    table = QuestionCount.__table__
+    connection.execute(table.update()
+                       .where(table.c.scope.in_([TOTAL_SCOPE, str(category)]))
+                       .values(total=table.c.total + delta))
+
+
+@event.listens_for(Question, 'after_insert')
+def _count_insert(mapper, connection, target):
+    _adjust_counts(connection, target.category, 1)
+    _record_change(target, 'insert')
+
+
+@event.listens_for(Question, 'after_delete')
+def _count_delete(mapper, connection, target):
+    _adjust_counts(connection, target.category, -1)
+    _record_change(target, 'delete')
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    # active_history loads the old value on assignment, so the update
+    # hook below can see which counter and index bucket a question left.
+    pass
+
+for _column in (Question.category, Question.difficulty):
+    event.listen(_column, 'set', _load_previous_value, active_history=True)
+
+
+@event.listens_for(Question, 'after_update')
+def _count_update(mapper, connection, target):
+    state = inspect(target)
+    previous = {name: state.attrs[name].history.deleted[0]
+                for name in ('question', 'answer', 'category', 'difficulty')
+                if state.attrs[name].history.deleted}
+
+    if 'category' in previous:
+        table = QuestionCount.__table__
+        for category, delta in ((previous['category'], -1), (target.category, 1)):
+            connection.execute(table.update()
+                               .where(table.c.scope == str(category))
+                               .values(total=table.c.total + delta))
+    _record_change(target, 'update', previous)
+
+
+@event.listens_for(Category, 'after_insert')
+def _category_insert(mapper, connection, target):
+    connection.execute(QuestionCount.__table__.insert().values(scope=str(target.id), total=0))
+    _record_change(target, 'insert')
+
+
+@event.listens_for(Category, 'after_update')
+def _category_update(mapper, connection, target):
+    _record_change(target, 'update')
+
+
+@event.listens_for(Category, 'after_delete')
+def _category_delete(mapper, connection, target):
+    table = QuestionCount.__table__
+    connection.execute(table.delete().where(table.c.scope == str(target.id)))
+    _record_change(target, 'delete')
+
+
+"""
+Change listeners
+    in-process indexes and caches register here to hear about question
+    and category writes. Changes are queued on the session and only
+    reported once the transaction commits, so a rolled back write is
+    never seen.
+"""
+_change_listeners = {
+    Question.__tablename__: [],
+    Category.__tablename__: [],
+}
+
+def on_question_change(listener):
+    """
+    Register ``listener(action, question, previous)``. ``action`` is 'insert',
+    'update' or 'delete', ``question`` the row as ``format()`` returns it and
+    ``previous`` the old values of the columns an update changed.
+    """
+    _change_listeners[Question.__tablename__].append(listener)
+    return listener
+
+
+def on_category_change(listener):
+    """Register ``listener(action, category, previous)``; same contract as questions."""
+    _change_listeners[Category.__tablename__].append(listener)
+    return listener
+
+
+_reload_listeners = []
+
+def on_questions_reloaded(listener):
+    """
+    Register ``listener()``, called after questions were written in bulk
+    without going through the session (see importer.py); per-row change
+    listeners are not told about those rows, so rebuild from the table.
+    """
+    _reload_listeners.append(listener)
+    return listener
+
+
+def report_questions_reloaded():
+    for listener in _reload_listeners:
+        listener()
+
+
+def _record_change(target, action, previous=None):
+    changes = object_session(target).info.setdefault('model_changes', [])
+    changes.append((target.__tablename__, action, target.format(), previous or {}))
+
+
+@event.listens_for(Session, 'after_commit')
+def _report_changes(session):
+    for table, action, row, previous in session.info.pop('model_changes', ()):
+        for listener in _change_listeners[table]:
+            listener(action, row, previous)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop('model_changes', None)
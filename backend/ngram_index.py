@@ -0,0 +1,127 @@
+"""
+In-memory trigram index for substring search.
+
+Every lowercased question is split into overlapping three-character grams;
+each gram maps to a sorted array of the ids that contain it. A search
+intersects the posting lists of the term's grams, starting from the
+shortest, and then checks each candidate with a plain ``in`` so results
+match ``ILIKE '%term%'`` exactly (``%`` and ``_`` in the term are literal).
+"""
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from threading import RLock
+
+# Rough per-entry costs used to keep the index under its memory budget.
+POSTING_BYTES = 8
+GRAM_BYTES = 200
+
+# Joins question and answer so no gram spans the two.
+FIELD_SEPARATOR = '\x00'
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def grams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Lowercased documents by id plus a posting list per trigram."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.estimated_bytes = 0
+        self.last_build_seconds = None
+        self._docs = {}
+        self._postings = {}
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def build(self, rows):
+        """
+        Replace the index with ``rows`` of ``(id, text)`` in ascending id
+        order. Raises MemoryBudgetExceeded, leaving the index empty, if the
+        estimate passes ``max_bytes``.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._docs, self._postings, self.estimated_bytes = {}, {}, 0
+            try:
+                for doc_id, text in rows:
+                    self._add(doc_id, text, enforce_budget=True)
+            except MemoryBudgetExceeded:
+                self._docs, self._postings, self.estimated_bytes = {}, {}, 0
+                raise
+            finally:
+                self.last_build_seconds = time.perf_counter() - started
+
+    def add(self, doc_id, text):
+        with self._lock:
+            self._add(doc_id, text)
+
+    def remove(self, doc_id):
+        with self._lock:
+            text = self._docs.pop(doc_id, None)
+            if text is None:
+                return
+            self.estimated_bytes -= sys.getsizeof(text)
+            for gram in grams(text):
+                posting = self._postings[gram]
+                i = bisect_left(posting, doc_id)
+                if i < len(posting) and posting[i] == doc_id:
+                    del posting[i]
+                    self.estimated_bytes -= POSTING_BYTES
+                if not posting:
+                    del self._postings[gram]
+                    self.estimated_bytes -= GRAM_BYTES
+
+    def replace(self, doc_id, text):
+        with self._lock:
+            self.remove(doc_id)
+            self._add(doc_id, text)
+
+    def search(self, term):
+        """Ids, ascending, of every document containing ``term`` case-insensitively."""
+        term = term.lower()
+        with self._lock:
+            if len(term) < 3:
+                # Too short to have a gram: check every document in memory.
+                return sorted(doc_id for doc_id, text in self._docs.items() if term in text)
+
+            postings = sorted((self._postings.get(gram, ()) for gram in grams(term)), key=len)
+            shortest, others = postings[0], postings[1:]
+            return [doc_id for doc_id in shortest
+                    if all(_contains(posting, doc_id) for posting in others)
+                    and term in self._docs[doc_id]]
+
+    def _add(self, doc_id, text, enforce_budget=False):
+        # Only a build enforces the budget; a single write that tips the
+        # estimate over it is picked up by the next rebuild instead.
+        text = text.lower()
+        self._docs[doc_id] = text
+        self.estimated_bytes += sys.getsizeof(text)
+        for gram in grams(text):
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('q')
+                self.estimated_bytes += GRAM_BYTES
+            if not posting or posting[-1] < doc_id:
+                posting.append(doc_id)
+            else:
+                posting.insert(bisect_left(posting, doc_id), doc_id)
+            self.estimated_bytes += POSTING_BYTES
+
+        if enforce_budget and self.estimated_bytes > self.max_bytes:
+            raise MemoryBudgetExceeded(
+                f'trigram index passed {self.max_bytes} bytes at {len(self._docs)} documents')
+
+
+def _contains(posting, doc_id):
+    i = bisect_left(posting, doc_id)
+    return i < len(posting) and posting[i] == doc_id
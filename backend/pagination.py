@@ -0,0 +1,69 @@
+"""
+Paging helpers shared by the listing endpoints.
+
+Shallow pages are read with LIMIT/OFFSET. Deep pages and requests that carry
+a cursor use keyset paging (``id > cursor``) so the cost of a page stays flat
+no matter where it sits in the table.
+"""
+import base64
+import binascii
+
+from sqlalchemy import func
+
+# Past this many rows an OFFSET scan starts to hurt; seek to the page
+# boundary through the key index instead and page from there.
+KEYSET_THRESHOLD = 1000
+
+
+def encode_cursor(last_key):
+    """Turn the last key of a page into an opaque cursor string."""
+    raw = str(last_key).encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the key stored in ``cursor``. Raises ValueError if it is malformed."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii'))
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(f'invalid cursor: {cursor!r}') from e
+
+
+def paginate(bind, statement, key, page=1, cursor=None, per_page=10):
+    """
+    Fetch one page of the Core ``statement`` ordered by ``key``, executing
+    on ``bind`` (a session or connection).
+
+    Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+    A cursor takes precedence over ``page``.
+    """
+    offset = 0
+    if cursor is not None:
+        statement = statement.where(key > decode_cursor(cursor))
+    elif page < 1:
+        return [], None
+    elif page > 1:
+        offset = (page - 1) * per_page
+        if offset >= KEYSET_THRESHOLD:
+            # Only the key column is walked to find where the page starts.
+            boundary = bind.execute(statement.with_only_columns([key])
+                                    .order_by(key)
+                                    .offset(offset)
+                                    .limit(1)).scalar()
+            if boundary is None:
+                return [], None
+            statement = statement.where(key >= boundary)
+            offset = 0
+
+    rows = bind.execute(statement.order_by(key).offset(offset).limit(per_page + 1)).fetchall()
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    return rows, encode_cursor(rows[-1][key])
+
+
+def count(bind, statement, key):
+    """COUNT(key) for ``statement`` without loading any rows."""
+    return bind.execute(statement.with_only_columns([func.count(key)]).order_by(None)).scalar()
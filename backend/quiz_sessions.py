@@ -0,0 +1,59 @@
+"""
+Server-side quiz sessions.
+
+Starting a session draws up to ``max_questions`` of the category's ids in
+random order and stores them in the cache backend as a packed deck: a
+4-byte count followed by 4 bytes per id. Each round bumps the session's
+position counter and reads a single id at that offset, so a round costs
+O(1) on any backend and the client no longer resends every question it
+has seen.
+"""
+import random
+import secrets
+import struct
+import sys
+from array import array
+
+# The count and every id are unsigned 32-bit; question ids are INTEGER columns.
+ID = struct.Struct('!I')
+
+
+class QuizSessionStore:
+    """
+    Decks by session token in ``backend``; a session expires ``ttl`` seconds
+    after it starts and deals at most ``max_questions``.
+    """
+
+    def __init__(self, backend, ttl=3600, max_questions=10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_questions = max_questions
+
+    def start(self, ids):
+        """Deal a new deck from ``ids``; returns its token and its length."""
+        deck = array('I', random.sample(ids, min(len(ids), self.max_questions)))
+        if sys.byteorder == 'little':
+            deck.byteswap()  # stored big-endian, like ID
+
+        token = secrets.token_urlsafe(16)
+        self.backend.set(f'quiz:{token}', ID.pack(len(deck)) + deck.tobytes(), ttl=self.ttl)
+        return token, len(deck)
+
+    def draw(self, token):
+        """
+        Deal the next id. Returns ``(question_id, remaining)``; the id is None
+        once the deck is empty. Raises KeyError for an unknown or expired token.
+        """
+        header = self.backend.getrange(f'quiz:{token}', 0, ID.size)
+        if not header:
+            raise KeyError(token)
+
+        position = self.backend.incr(f'quiz:{token}:position', ttl=self.ttl)
+        raw = self.backend.getrange(f'quiz:{token}', position * ID.size, ID.size)
+        if not raw:
+            return None, 0
+        return ID.unpack(raw)[0], ID.unpack(header)[0] - position
+
+    def end(self, token):
+        self.backend.delete(f'quiz:{token}')
+        self.backend.delete(f'quiz:{token}:position')
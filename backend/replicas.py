@@ -0,0 +1,144 @@
+"""
+Read replica routing.
+
+With DATABASE_REPLICA_URLS set, the routes marked ``read_only`` run their
+queries on a replica, picked round-robin among the healthy ones, while
+everything else stays on the primary. The session does the routing
+(``RoutingSession.get_bind``), so the models, the repository and the
+search backends need no changes. Flushes and INSERT/UPDATE/DELETE
+statements always go to the primary.
+
+A replica is marked down when connecting to it fails, and probed again
+with ``SELECT 1`` every ``check_interval`` seconds. With no healthy
+replica, reads fall back to the primary.
+
+Replicas lag behind the primary, so a client that just wrote would not
+see its own change. A response to a request that committed on the
+primary sets a short-lived cookie, and reads from that client stay on the
+primary until it expires. The response and category caches are filled
+only from the primary (``primary_reads``), so a lagging replica never
+stores an old page under the version a write has just bumped.
+"""
+import functools
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+
+from db_pool import engine_options, pool_stats
+
+STICKY_COOKIE = 'qm_primary'
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the reads of a ``read_only`` request to its replica."""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_request_context() else None
+        if replica is None or self._flushing or isinstance(clause, UpdateBase):
+            return super().get_bind(mapper, clause)
+        return replica
+
+
+@contextmanager
+def primary_reads():
+    """Run the enclosed queries on the primary, even inside a ``read_only`` request."""
+    replica = g.pop('db_replica', None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """The replica engines of one app, their health, and the per-request routing."""
+
+    def __init__(self, urls, check_interval=10, sticky_seconds=5):
+        self.engines = [create_engine(url, **engine_options(url)) for url in urls]
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        # engine -> (healthy, monotonic time of the last check); probed on first use.
+        self._health = {engine: (False, float('-inf')) for engine in self.engines}
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    def init_app(self, app, primary):
+        if not self.engines:
+            return
+        event.listen(primary, 'commit', self._note_write)
+        app.after_request(self._after_request)
+
+    def choose(self):
+        """The next healthy replica in turn, or None when every one is down."""
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._turn) % len(self.engines)]
+            healthy, checked = self._health[engine]
+            if time.monotonic() - checked >= self.check_interval:
+                healthy = self._probe(engine)
+            if healthy:
+                return engine
+        return None
+
+    def route_reads(self):
+        """Run the rest of this request's reads on a replica, unless the client just wrote."""
+        if self.engines and not request.cookies.get(STICKY_COOKIE):
+            g.db_replica = self.choose()
+
+    def read_only(self, view):
+        """Decorate a view whose queries may all run on a replica."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            self.route_reads()
+            return view(*args, **kwargs)
+        return wrapper
+
+    def stats(self):
+        return [dict(pool_stats(engine), healthy=self._health[engine][0]) for engine in self.engines]
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+    def _probe(self, engine):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            healthy = True
+        except DBAPIError:
+            healthy = False
+        self._set_health(engine, healthy)
+        return healthy
+
+    def _set_health(self, engine, healthy):
+        with self._lock:
+            self._health[engine] = (healthy, time.monotonic())
+
+    def _handle_error(self, context):
+        # No connection means connecting failed; is_disconnect means it was lost.
+        if context.connection is None or context.is_disconnect:
+            self._set_health(context.engine, False)
+
+    @staticmethod
+    def _note_write(conn):
+        if has_request_context():
+            g.db_wrote = True
+
+    def _after_request(self, response):
+        if g.pop('db_wrote', False):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,85 @@
+"""
+Read-only question queries for the hot read paths.
+
+Each query is a Core ``select()`` over the question columns, executed on the
+session's connection. Rows come back as QuestionRecord tuples instead of
+mapped Question instances, so nothing lands in the identity map or gets
+tracked for changes. Writes still go through the models.
+"""
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import db, Question
+import pagination
+
+questions = Question.__table__
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = [questions.c[field] for field in QUESTION_FIELDS]
+
+
+class QuestionRecord(namedtuple('QuestionRecord', QUESTION_FIELDS)):
+    """One question row; ``format()`` returns what ``Question.format()`` does."""
+    __slots__ = ()
+
+    def format(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            # The API has always sent category ids as strings.
+            'category': None if self.category is None else str(self.category),
+            'difficulty': self.difficulty
+            }
+
+
+def select_questions(*criteria):
+    """SELECT of the question columns, filtered by every one of ``criteria``."""
+    statement = select(QUESTION_COLUMNS)
+    for criterion in criteria:
+        statement = statement.where(criterion)
+    return statement
+
+
+def fetch(statement):
+    return [QuestionRecord._make(row) for row in db.session.execute(statement)]
+
+
+def page(*criteria, page=1, cursor=None, per_page=10):
+    """One page of matching questions in id order; see ``pagination.paginate``."""
+    rows, next_cursor = pagination.paginate(db.session, select_questions(*criteria), questions.c.id,
+                                            page=page, cursor=cursor, per_page=per_page)
+    return [QuestionRecord._make(row) for row in rows], next_cursor
+
+
+def count(*criteria):
+    return pagination.count(db.session, select_questions(*criteria), questions.c.id)
+
+
+def by_ids(ids):
+    """Records for ``ids`` in the same order, skipping ids that no longer exist."""
+    if not ids:
+        return []
+    found = {record.id: record for record in fetch(select_questions(questions.c.id.in_(ids)))}
+    return [found[question_id] for question_id in ids if question_id in found]
+
+
+def stream(*criteria, batch_size=1000):
+    """
+    Yield every matching record in id order through a server-side cursor
+    (``stream_results``), ``batch_size`` rows per fetch.
+    """
+    statement = (select_questions(*criteria)
+                 .order_by(questions.c.id)
+                 .execution_options(stream_results=True))
+    result = db.session.execute(statement)
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield QuestionRecord._make(row)
+    finally:
+        result.close()
@@ -2,15 +2,12 @@
 """
 Simple script to run the Flask app
 """
-from flaskr import create_app
-from models import setup_db, Question, Category, db
+from flaskr import app
+from models import Question, Category, db
 
 def init_db():
     """Initialize the database with sample data"""
-    app = create_app()
     with app.app_context():
-        setup_db(app)
-        
         # Check if categories already exist
         if Category.query.count() == 0:
             # Add categories
@@ -85,5 +82,4 @@ def init_db():
 
 if __name__ == "__main__":
     init_db()
-    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
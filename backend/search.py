@@ -0,0 +1,274 @@
+"""
+Search backends for the searchTerm branch of POST /questions.
+
+``substring`` is the original case-insensitive LIKE scan. ``fulltext`` uses
+FTS5 on SQLite and a GIN-indexed tsvector on Postgres. The database keeps
+those indexes in step with every question write (FTS5 through triggers,
+Postgres through the expression index) and ranks matches by relevance.
+Every word of the search term is matched as a prefix. ``ngram`` keeps the
+exact substring semantics but answers from an in-memory trigram index.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+from models import db, Question, on_question_change, on_questions_reloaded
+from replicas import primary_reads
+from ngram_index import TrigramIndex, MemoryBudgetExceeded, FIELD_SEPARATOR
+import repository
+
+SQLITE_FTS_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts
+       USING fts5(question, content='questions', content_rowid='id')"""
+# Dropping the questions table drops these too; migrations recreate them.
+SQLITE_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_ai AFTER INSERT ON questions BEGIN
+         INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_ad AFTER DELETE ON questions BEGIN
+         INSERT INTO questions_fts(questions_fts, rowid, question)
+         VALUES ('delete', old.id, old.question);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_au AFTER UPDATE OF question ON questions BEGIN
+         INSERT INTO questions_fts(questions_fts, rowid, question)
+         VALUES ('delete', old.id, old.question);
+         INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+       END""",
+]
+SQLITE_FTS_SCHEMA = [SQLITE_FTS_TABLE] + SQLITE_FTS_TRIGGERS
+
+# 'simple' skips stemming and stop words, so "What" still matches "what".
+POSTGRES_VECTOR = "to_tsvector('simple', coalesce(question, ''))"
+
+
+def _words(term):
+    return re.findall(r'\w+', term)
+
+
+class SubstringSearch:
+    """Case-insensitive substring match on the question text; no index needed."""
+    name = 'substring'
+
+    def install(self):
+        pass
+
+    def search(self, term, page=1, per_page=10):
+        match = repository.questions.c.question.ilike(f'%{term}%')
+        questions = repository.fetch(repository.select_questions(match)
+                                     .order_by(repository.questions.c.id)
+                                     .offset((page - 1) * per_page)
+                                     .limit(per_page))
+        return questions, repository.count(match)
+
+
+class SqliteFullTextSearch:
+    """FTS5 external-content table over questions.question, ranked by bm25."""
+    name = 'fulltext'
+
+    @staticmethod
+    def available():
+        try:
+            sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(x)')
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def install(self):
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'")).first()
+        if exists:
+            return
+        # IF NOT EXISTS: workers booting together can all get past the check.
+        for statement in SQLITE_FTS_SCHEMA:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
+        db.session.commit()
+
+    def search(self, term, page=1, per_page=10):
+        match = ' '.join('"{}"*'.format(word) for word in _words(term))
+        if not match:
+            return [], 0
+
+        total = db.session.execute(
+            text("SELECT count(*) FROM questions_fts WHERE questions_fts MATCH :match"),
+            {'match': match}).scalar()
+        ids = [row[0] for row in db.session.execute(
+            text("SELECT rowid FROM questions_fts WHERE questions_fts MATCH :match "
+                 "ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {'match': match, 'limit': per_page, 'offset': (page - 1) * per_page})]
+        return repository.by_ids(ids), total
+
+
+class PostgresFullTextSearch:
+    """tsvector expression index (GIN) over questions.question, ranked by ts_rank."""
+    name = 'fulltext'
+
+    @staticmethod
+    def available():
+        return True
+
+    def install(self):
+        # CONCURRENTLY keeps the table writable but cannot run in a transaction.
+        with db.get_engine().connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_tsv "
+                f"ON questions USING gin ({POSTGRES_VECTOR})"))
+
+    def search(self, term, page=1, per_page=10):
+        words = _words(term)
+        if not words:
+            return [], 0
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+
+        where = f"{POSTGRES_VECTOR} @@ to_tsquery('simple', :tsquery)"
+        total = db.session.execute(
+            text(f"SELECT count(*) FROM questions WHERE {where}"),
+            {'tsquery': tsquery}).scalar()
+        ids = [row[0] for row in db.session.execute(
+            text(f"SELECT id FROM questions WHERE {where} "
+                 f"ORDER BY ts_rank({POSTGRES_VECTOR}, to_tsquery('simple', :tsquery)) DESC, id "
+                 f"LIMIT :limit OFFSET :offset"),
+            {'tsquery': tsquery, 'limit': per_page, 'offset': (page - 1) * per_page})]
+        return repository.by_ids(ids), total
+
+
+class NgramSearch:
+    """
+    Substring search answered from an in-memory TrigramIndex, built when
+    the backend is installed (or by the first search when it was not) and
+    updated by question writes in this process; ``max_age`` bounds how
+    long writes made by other worker processes can go unseen. If the index
+    does not fit in ``max_bytes`` the backend falls back to SubstringSearch.
+    """
+    name = 'ngram'
+
+    def __init__(self, max_bytes, include_answer=False, max_age=300):
+        self.index = TrigramIndex(max_bytes)
+        self.include_answer = include_answer
+        self.max_age = max_age
+        self.fallback = None
+        self.built = False
+        self._built_at = 0
+        self._build_lock = threading.Lock()
+
+    def install(self):
+        self.rebuild()
+
+    def rebuild(self):
+        with self._build_lock:
+            self._rebuild()
+
+    def _stale(self):
+        return not self.built or time.monotonic() - self._built_at > self.max_age
+
+    def _rebuild(self):
+        columns = [Question.id, Question.question]
+        if self.include_answer:
+            columns.append(Question.answer)
+
+        # A lagging replica would drop writes this process has already applied.
+        with primary_reads():
+            rows = db.session.query(*columns).order_by(Question.id).yield_per(10000)
+            try:
+                self.index.build((row[0], self._text(*row[1:])) for row in rows)
+                self.fallback = None
+            except MemoryBudgetExceeded as e:
+                current_app.logger.warning('%s; using substring search.', e)
+                self.fallback = SubstringSearch()
+        self.built = True
+        self._built_at = time.monotonic()
+        current_app.logger.info('Trigram index rebuilt over %d questions in %.3fs (~%d bytes).',
+                                len(self.index), self.index.last_build_seconds,
+                                self.index.estimated_bytes)
+
+    def stats(self):
+        """Size and cost of the last build; both None until the first one."""
+        built = self.built and self.fallback is None
+        return {'backend': self.name, 'questions': len(self.index),
+                'last_build_seconds': self.index.last_build_seconds if built else None,
+                'estimated_bytes': self.index.estimated_bytes if built else None}
+
+    def search(self, term, page=1, per_page=10):
+        if self._stale():
+            with self._build_lock:
+                if self._stale():
+                    self._rebuild()
+        if self.fallback is not None:
+            return self.fallback.search(term, page, per_page)
+
+        ids = self.index.search(term)
+        start = (page - 1) * per_page
+        return repository.by_ids(ids[start:start + per_page]), len(ids)
+
+    def apply(self, action, question, previous):
+        if self.fallback is not None or not self.built:
+            return
+        if action == 'delete':
+            self.index.remove(question['id'])
+            return
+
+        fields = [question['question']]
+        if self.include_answer:
+            fields.append(question['answer'])
+        if action == 'insert':
+            self.index.add(question['id'], self._text(*fields))
+        else:
+            self.index.replace(question['id'], self._text(*fields))
+
+    @staticmethod
+    def _text(*fields):
+        return FIELD_SEPARATOR.join(field or '' for field in fields)
+
+
+FULLTEXT_BACKENDS = {
+    'sqlite': SqliteFullTextSearch,
+    'postgresql': PostgresFullTextSearch,
+}
+
+
+def create_search_backend(app, name='auto', install=True):
+    """
+    Pick and install the search backend named by ``name``: 'substring',
+    'ngram', 'fulltext', or 'auto' for full text when the database supports
+    it. Falls back to substring search when full text is unavailable.
+    With ``install=False`` nothing touches the database: full text tables
+    are left to ``flask db-init`` and the trigram index to the first search.
+    """
+    if name == 'ngram':
+        backend = NgramSearch(app.config['SEARCH_NGRAM_MAX_BYTES'],
+                              include_answer=app.config['SEARCH_NGRAM_INCLUDE_ANSWER'],
+                              max_age=app.config['SEARCH_NGRAM_MAX_AGE'])
+    elif name != 'substring':
+        dialect = db.get_engine(app).dialect.name
+        backend_class = FULLTEXT_BACKENDS.get(dialect)
+        if backend_class is not None and backend_class.available():
+            backend = backend_class()
+        else:
+            if name == 'fulltext':
+                app.logger.warning('Full text search is not available on %s; '
+                                   'using substring search.', dialect)
+            backend = SubstringSearch()
+    else:
+        backend = SubstringSearch()
+
+    if install:
+        with app.app_context():
+            backend.install()
+    return backend
+
+
+@on_question_change
+def _track_question_change(action, question, previous):
+    backend = current_app.extensions.get('search')
+    if hasattr(backend, 'apply'):
+        backend.apply(action, question, previous)
+
+
+@on_questions_reloaded
+def _reload_search_index():
+    backend = current_app.extensions.get('search')
+    if hasattr(backend, 'rebuild'):
+        backend.rebuild()
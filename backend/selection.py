@@ -0,0 +1,227 @@
+"""
+Random question selection for /quizzes.
+
+The ids of every (category, difficulty) pair are kept in sorted int
+arrays, so a quiz round draws a question in constant time and memory
+instead of loading every remaining candidate row and picking one in
+Python, or filtering on difficulty in SQL.
+"""
+import random
+from array import array
+from bisect import bisect_left, insort
+from threading import RLock
+
+from flask import current_app
+
+from models import db, Question, on_question_change, on_questions_reloaded
+from replicas import primary_reads
+
+# Draws that may land on an already asked question before we fall back to
+# scanning the ids that are left. With half the category asked, all of
+# them missing happens once in 65536 rounds.
+MAX_DRAWS = 16
+# Version stamp in the cache backend, bumped by every write that moves an id.
+VERSION = 'question-ids'
+
+
+class QuestionIndex:
+    """
+    Question ids per (category, difficulty). Built lazily from one scan of
+    those three columns and kept current by question writes in this
+    process. Every write that moves an id also bumps a version stamp in the
+    shared cache ``backend``; a worker rebuilds only once the stamp has
+    moved past the version its ids were built at.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = RLock()
+        self._build_lock = RLock()
+        self._buckets = None
+        self._version = None
+
+    def rebuild(self):
+        """Scan the ids again; returns the new buckets."""
+        with self._build_lock:
+            # Read first: a write during the scan leaves the index stale.
+            version = self.backend.version(VERSION)
+            buckets = {}
+            # A lagging replica would miss writes the stamp already counts.
+            with primary_reads():
+                rows = (db.session.query(Question.category, Question.difficulty, Question.id)
+                        .order_by(Question.id)
+                        .yield_per(10000))
+                for category, difficulty, question_id in rows:
+                    buckets.setdefault((str(category), difficulty), array('q')).append(question_id)
+
+            with self._lock:
+                self._buckets = buckets
+                self._version = version
+            return buckets
+
+    def invalidate(self):
+        """Drop the ids here and in every worker; the next draw rebuilds them."""
+        self.backend.bump(VERSION)
+        with self._lock:
+            self._buckets = None
+
+    def _ensure_built(self):
+        """The current buckets, rebuilt first when missing or outdated."""
+        version = self.backend.version(VERSION)
+        with self._lock:
+            if self._buckets is not None and self._version == version:
+                return self._buckets
+        with self._build_lock:
+            # Another thread may have rebuilt while this one waited.
+            with self._lock:
+                if self._buckets is not None and self._version == version:
+                    return self._buckets
+            return self.rebuild()
+
+    @staticmethod
+    def _select(buckets, category=None, difficulties=None):
+        """The buckets of ``category`` (every one when falsy) with a difficulty in ``difficulties``."""
+        return [bucket for (bucket_category, difficulty), bucket in buckets.items()
+                if (not category or bucket_category == str(category))
+                and (difficulties is None or difficulty in difficulties)]
+
+    def add(self, category, difficulty, question_id):
+        with self._lock:
+            if self._buckets is None:
+                return
+            bucket = self._buckets.setdefault((str(category), difficulty), array('q'))
+            if not bucket or bucket[-1] < question_id:
+                bucket.append(question_id)
+            else:
+                insort(bucket, question_id)
+
+    def discard(self, question_id, category=None, difficulty=None):
+        with self._lock:
+            if self._buckets is None:
+                return
+            if category is None:
+                buckets = self._buckets.values()
+            else:
+                buckets = [self._buckets.get((str(category), difficulty), array('q'))]
+            for bucket in buckets:
+                i = bisect_left(bucket, question_id)
+                if i < len(bucket) and bucket[i] == question_id:
+                    del bucket[i]
+                    return
+
+    def sample(self, category=None, exclude=frozenset(), difficulties=None):
+        """
+        Return a random question id from ``category`` (every category when
+        falsy) that is not in ``exclude``, or None when nothing is left.
+        Each remaining id is equally likely.
+        """
+        ids = self.sample_many(category, exclude, 1, difficulties)
+        return ids[0] if ids else None
+
+    def sample_many(self, category=None, exclude=frozenset(), count=1, difficulties=None):
+        """
+        Up to ``count`` distinct random ids from ``category`` that are not
+        in ``exclude``, in random order; fewer when fewer are left. With
+        ``difficulties`` (e.g. ``range(3, 6)``) only those levels are drawn.
+        """
+        return self._sample_many(self._ensure_built(), category, exclude, count, difficulties)
+
+    def _sample_many(self, buckets, category, exclude, count, difficulties):
+        with self._lock:
+            buckets = self._select(buckets, category, difficulties)
+            size = sum(len(bucket) for bucket in buckets)
+
+            if len(exclude) + count <= size:
+                chosen = []
+                taken = set()
+                for _ in range(count * MAX_DRAWS):
+                    question_id = _nth(buckets, random.randrange(size))
+                    if question_id not in exclude and question_id not in taken:
+                        taken.add(question_id)
+                        chosen.append(question_id)
+                        if len(chosen) == count:
+                            return chosen
+
+            remaining = [question_id for bucket in buckets for question_id in bucket
+                         if question_id not in exclude]
+
+        return random.sample(remaining, min(count, len(remaining)))
+
+    def sample_ramp(self, category=None, exclude=frozenset(), count=1, difficulties=None, played=0):
+        """
+        Up to ``count`` ids that get harder by one level per question: the
+        quiz's question number ``played`` (0 for the first) is asked at the
+        lowest of ``difficulties`` (default: every level in the category)
+        plus ``played``, capped at the highest. When a level has nothing left
+        the nearest one that does is used, the harder one on a tie.
+        """
+        buckets = self._ensure_built()
+        with self._lock:
+            levels = sorted({difficulty for (bucket_category, difficulty), bucket in buckets.items()
+                             if bucket and (not category or bucket_category == str(category))
+                             and difficulty is not None
+                             and (difficulties is None or difficulty in difficulties)})
+        exclude = set(exclude)
+        chosen = []
+        for n in range(played, played + count):
+            if not levels:
+                break
+            target = levels[min(n, len(levels) - 1)]
+            for level in sorted(levels, key=lambda level: (abs(level - target), -level)):
+                ids = self._sample_many(buckets, category, exclude, 1, (level,))
+                if ids:
+                    chosen.append(ids[0])
+                    exclude.add(ids[0])
+                    break
+            else:
+                break
+        return chosen
+
+    def ids(self, category=None, difficulties=None):
+        """A copy of the ids in ``category`` (every id when falsy), optionally of ``difficulties`` only."""
+        buckets = self._ensure_built()
+        with self._lock:
+            ids = array('q')
+            for bucket in self._select(buckets, category, difficulties):
+                ids.extend(bucket)
+            return ids
+
+    def apply(self, action, question, previous):
+        if action == 'insert':
+            self.add(question['category'], question['difficulty'], question['id'])
+        elif action == 'delete':
+            self.discard(question['id'], question['category'], question['difficulty'])
+        elif 'category' in previous or 'difficulty' in previous:
+            self.discard(question['id'], previous.get('category', question['category']),
+                         previous.get('difficulty', question['difficulty']))
+            self.add(question['category'], question['difficulty'], question['id'])
+        else:
+            return
+
+        version = self.backend.bump(VERSION)
+        with self._lock:
+            # Applied here already; only a bump from elsewhere in between calls for a rebuild.
+            if self._version == version - 1:
+                self._version = version
+
+
+def _nth(buckets, n):
+    for bucket in buckets:
+        if n < len(bucket):
+            return bucket[n]
+        n -= len(bucket)
+    raise IndexError(n)
+
+
+@on_question_change
+def _track_question_change(action, question, previous):
+    index = current_app.extensions.get('question_index')
+    if index is not None:
+        index.apply(action, question, previous)
+
+
+@on_questions_reloaded
+def _reload_question_index():
+    index = current_app.extensions.get('question_index')
+    if index is not None:
+        index.invalidate()
@@ -0,0 +1,47 @@
+"""
+JSON encoding for every API response.
+
+``dumps`` uses orjson when it is installed (``pip install orjson``) and the
+standard library otherwise; both write compact JSON with sorted keys, as
+Flask's jsonify does.
+"""
+import json
+
+from flask import current_app, json as flask_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# Flask's encoder knows dates, UUIDs and the like; fall back to it for those.
+_fallback = flask_json.JSONEncoder()
+_encoder = json.JSONEncoder(separators=(',', ':'), sort_keys=True, default=_fallback.default)
+
+if orjson is not None:
+    ENCODER = 'orjson'
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """Serialize ``obj`` to compact JSON bytes."""
+        return orjson.dumps(obj, default=_fallback.default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    ENCODER = 'json'
+
+    def dumps(obj):
+        """Serialize ``obj`` to compact JSON bytes."""
+        return _encoder.encode(obj).encode('utf-8')
+
+    loads = json.loads
+
+
+def jsonify(*args, **kwargs):
+    """Drop-in for ``flask.jsonify`` that encodes with ``dumps``."""
+    if args and kwargs:
+        raise TypeError('jsonify() takes either args or kwargs, not both')
+    data = args[0] if len(args) == 1 else (list(args) if args else kwargs)
+    return current_app.response_class(dumps(data) + b'\n',
+                                      mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
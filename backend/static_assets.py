@@ -0,0 +1,122 @@
+"""
+The React build, scanned once at startup and served from memory.
+
+Every file under the static folder is read into an ``Asset``: its bytes,
+type, strong ETag, and gzip/brotli variants. Variants come from ``.gz`` and
+``.br`` files next to the asset when the build (or ``flask
+precompress-static``) made them. Otherwise gzip is compressed at startup,
+and brotli too when the ``brotli`` package is installed. Requests pick the
+best variant the client accepts. Files whose name carries a content hash
+(``main.5b227e34.chunk.js``) never change under the same URL and are
+cached as immutable. Everything else, index.html included, is
+revalidated with its ETag.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from collections import namedtuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# CRA and webpack put an 8+ character hex hash before the extension.
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                'application/manifest+json')
+# Below this size compression saves less than the headers it costs.
+MIN_COMPRESS_BYTES = 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+Asset = namedtuple('Asset', 'path mimetype etag hashed variants')
+
+
+def _compressible(mimetype):
+    return mimetype.startswith(COMPRESSIBLE)
+
+
+def _compress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data)
+
+
+class StaticAssets:
+    """The files under ``root`` by URL path relative to it ('index.html', 'static/js/...')."""
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        if os.path.isdir(root):
+            self.load()
+
+    def load(self):
+        assets = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(('.gz', '.br')):
+                    continue
+                full_path = os.path.join(directory, name)
+                path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                assets[path] = self._read(full_path, path)
+        self.assets = assets
+
+    def _read(self, full_path, path):
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        variants = {'identity': data}
+        if _compressible(mimetype) and len(data) >= MIN_COMPRESS_BYTES:
+            for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if os.path.exists(full_path + suffix):
+                    with open(full_path + suffix, 'rb') as f:
+                        variants[encoding] = f.read()
+                elif encoding == 'gzip' or brotli is not None:
+                    variants[encoding] = _compress(data, encoding)
+        return Asset(path, mimetype, hashlib.sha1(data).hexdigest(),
+                     bool(HASHED_NAME.search(os.path.basename(path))), variants)
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def response(self, app, request, path):
+        """Response for the asset at ``path``, or None when there is none."""
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        response = app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(asset.etag if encoding == 'identity' else f'{asset.etag}-{encoding}')
+        if asset.hashed:
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def precompress(self, echo=print):
+        """Write ``.gz`` (and ``.br`` with brotli installed) next to every compressible asset."""
+        encodings = [('gzip', '.gz')] + ([('br', '.br')] if brotli is not None else [])
+        for asset in self.assets.values():
+            data = asset.variants['identity']
+            if not _compressible(asset.mimetype) or len(data) < MIN_COMPRESS_BYTES:
+                continue
+            full_path = os.path.join(self.root, asset.path)
+            for encoding, suffix in encodings:
+                compressed = _compress(data, encoding)
+                with open(full_path + suffix, 'wb') as f:
+                    f.write(compressed)
+                echo(f"{asset.path}{suffix}: {len(data)} -> {len(compressed)} bytes")
+        self.load()
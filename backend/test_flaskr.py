@@ -1,10 +1,33 @@
 import os
+import shutil
 import unittest
 import json
+import asyncio
+import gzip
+import socketserver
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category, QuestionCount, question_count
+from ngram_index import TrigramIndex, MemoryBudgetExceeded
+from cache_backends import (LocalCacheBackend, SharedMemoryCacheBackend, RedisCacheBackend, CacheFull,
+                            default_cache_url)
+from db_pool import InstrumentedQueuePool, engine_options, pool_stats
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import Pool
+import migrations
+import serialization
+import repository
+import pagination
+from importer import QuestionImporter
+from search import SQLITE_FTS_TABLE, SQLITE_FTS_TRIGGERS
+from asgi import PooledWsgiToAsgi
+from instrumentation import SlowRequestProfiler
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -64,6 +87,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertTrue(len(data["categories"]))
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get("/categories")
+        etag = res.headers["ETag"]
+
+        res = self.client().get("/categories", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_categories_sees_new_category(self):
+        etag = self.client().get("/categories").headers["ETag"]
+        with self.app.app_context():
+            Category(type="Art").insert()
+
+        res = self.client().get("/categories", headers={"If-None-Match": etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Art", data["categories"].values())
+
+    # Frontend assets
+
+    def test_hashed_asset_is_immutable_and_gzipped(self):
+        res = self.client().get("/static/js/2.2947e9c0.chunk.js", headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("immutable", res.headers["Cache-Control"])
+        self.assertTrue(gzip.decompress(res.data))
+
+    def test_index_revalidates_with_etag(self):
+        res = self.client().get("/quiz")
+        self.assertIn(b"<html", res.data.lower())
+        self.assertIn("no-cache", res.headers["Cache-Control"])
+
+        res = self.client().get("/", headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
     # Questions list woth pagination
     
     def test_get_paginated_questions_success(self):
@@ -74,10 +133,156 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["questions"])
         self.assertTrue(data["total_questions"])
 
+    def test_get_questions_served_from_cache(self):
+        self.client().get("/questions?page=1")
+        res = self.client().get("/questions?page=1")
+        stats = json.loads(self.client().get("/cache/stats").data)
+
+        self.assertEqual(res.headers["X-Cache"], "HIT")
+        self.assertTrue(res.headers["ETag"])
+        self.assertGreaterEqual(stats["responses"]["hits"], 1)
+
+    def test_bulk_import_jsonl(self):
+        lines = [
+            {"question": "Bulk one?", "answer": "A", "category": "science", "difficulty": 1},
+            {"question": "Bulk two?", "answer": "B", "category": str(self.category_id), "difficulty": 2},
+            {"question": "what is  H2O commonly known as?", "answer": "Water", "category": "Science", "difficulty": 1},
+            {"question": "Bulk three?", "answer": "C", "category": "Nowhere", "difficulty": 1},
+        ]
+        total = json.loads(self.client().get("/questions").data)["total_questions"]
+        res = self.client().post("/questions/bulk?chunk_size=2",
+                                 data="\n".join(json.dumps(line) for line in lines),
+                                 content_type="application/x-ndjson")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data["imported"], data["duplicates"], data["rejected"]), (2, 1, 1))
+        self.assertEqual(data["errors"][0]["row"], 4)
+        self.assertEqual(data["total_questions"], total + 2)
+        self.assertEqual(json.loads(self.client().get("/questions").data)["total_questions"], total + 2)
+
+    def test_bulk_import_rejects_non_text_fields(self):
+        lines = [{"question": 42, "answer": "A", "category": "Science", "difficulty": 1},
+                 {"question": "Typed?", "answer": "A", "category": ["Science"], "difficulty": 1},
+                 {"question": "Typed?", "answer": "A", "category": "Science", "difficulty": True}]
+        res = self.client().post("/questions/bulk", data="\n".join(json.dumps(line) for line in lines),
+                                 content_type="application/x-ndjson")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data["imported"], data["rejected"]), (0, 3))
+
+    def test_bulk_import_adds_to_the_counters_in_place(self):
+        # A delete-and-reinsert recount would lose increments committed meanwhile.
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        with self.app.app_context():
+            engine = db.get_engine(self.app)
+            before = question_count(self.category_id), question_count()
+            event.listen(engine, "before_cursor_execute", record)
+            try:
+                QuestionImporter(chunk_size=2).run(
+                    {"question": f"Counted in place {i}?", "answer": "A", "category": self.category_id, "difficulty": 1}
+                    for i in range(3))
+            finally:
+                event.remove(engine, "before_cursor_execute", record)
+            self.assertEqual((question_count(self.category_id), question_count()),
+                             (before[0] + 3, before[1] + 3))
+        self.assertFalse([statement for statement in statements
+                          if statement.lstrip().upper().startswith("DELETE FROM QUESTION_COUNTS")])
+
+    def test_interrupted_import_still_counts_committed_chunks(self):
+        def rows():
+            yield {"question": "Before the crash?", "answer": "A", "category": "Science", "difficulty": 1}
+            raise RuntimeError("connection lost")
+
+        with self.app.app_context():
+            with self.assertRaises(RuntimeError):
+                QuestionImporter(chunk_size=1).run(rows())
+            self.assertEqual(question_count(), Question.query.count())
+
+    def test_bulk_import_csv_resumes_from_checkpoint(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source = os.path.join(directory.name, "pack.csv")
+        with open(source, "w") as f:
+            f.write("question,answer,category,difficulty\n")
+            for i in range(4):
+                f.write(f"Checkpointed {i}?,Yes,Science,1\n")
+        with open(source + ".checkpoint", "w") as f:
+            json.dump({"source": source, "rows": 3}, f)
+
+        result = self.app.test_cli_runner().invoke(args=["import-questions", source])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("4 rows read, 1 imported", result.output)
+        self.assertFalse(os.path.exists(source + ".checkpoint"))
+
+    def test_export_questions_ndjson(self):
+        res = self.client().get(f"/questions/export?category={self.category_id}")
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertIn(self.question_id, [row["id"] for row in rows])
+        self.assertTrue(all(row["category"] == str(self.category_id) for row in rows))
+
+    def test_export_questions_gzipped_csv(self):
+        res = self.client().get("/questions/export?format=csv&gzip=1&difficulty=1")
+        lines = gzip.decompress(res.data).decode().splitlines()
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(lines[0], "id,question,answer,category,difficulty")
+        self.assertTrue(all(line.endswith(",1") for line in lines[1:]))
+
+    def test_metrics_count_requests_and_queries(self):
+        self.client().get("/categories/{}/questions".format(self.category_id))
+        res = self.client().get("/metrics")
+        text = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('quizmaster_request_duration_seconds_count{route="/categories/<int:category_id>/questions",method="GET"} 1', text)
+        self.assertIn('quizmaster_db_queries_per_request_bucket{route="/categories/<int:category_id>/questions",le="+Inf"} 1', text)
+        self.assertIn('quizmaster_requests_total{route="/categories/<int:category_id>/questions",method="GET",status="200"} 1', text)
+
+    def test_ngram_index_size_is_reported(self):
+        app = create_app({"SEARCH_BACKEND": "ngram"})
+        stats = json.loads(app.test_client().get("/cache/stats").data)["search"]
+        text = app.test_client().get("/metrics").data.decode()
+
+        self.assertEqual(stats["backend"], "ngram")
+        self.assertGreater(stats["estimated_bytes"], 0)
+        self.assertIsNotNone(stats["last_build_seconds"])
+        self.assertIn(f"quizmaster_search_index_bytes {stats['estimated_bytes']}", text)
+        self.assertIn("quizmaster_search_index_build_seconds ", text)
+
     def test_get_questions_out_of_range_404(self):
         res = self.client().get("/questions?page=9999")
         self.assertEqual(res.status_code, 404)
         
+    def test_get_questions_cursor_follows_last_page(self):
+        with self.app.app_context():
+            for i in range(11):
+                self.db.session.add(Question(question=f"Filler {i}?", answer="Yes",
+                                             category=str(self.category_id), difficulty=1))
+            self.db.session.commit()
+
+        first = json.loads(self.client().get("/questions").data)
+        self.assertTrue(first["next_cursor"])
+
+        res = self.client().get(f"/questions?cursor={first['next_cursor']}")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(data["questions"][0]["id"], first["questions"][-1]["id"])
+
+        second = json.loads(self.client().get("/questions?page=2").data)
+        self.assertEqual(second["questions"], data["questions"])
+
+    def test_get_questions_bad_cursor_400(self):
+        res = self.client().get("/questions?cursor=not-a-cursor")
+        self.assertEqual(res.status_code, 400)
+
     # Delete question
 
     def test_delete_question_success(self):
@@ -88,6 +293,22 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertEqual(data["deleted"], self.question_id)
 
+    def test_delete_question_updates_total(self):
+        before = json.loads(self.client().get("/questions").data)["total_questions"]
+        res = self.client().delete(f"/questions/{self.question_id}")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total_questions"], before - 1)
+
+    def test_delete_question_lean_reply(self):
+        res = self.client().delete(f"/questions/{self.question_id}?lean=1")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["deleted"], self.question_id)
+        self.assertIn("total_questions", data)
+        self.assertNotIn("questions", data)
+
     def test_delete_question_not_found(self):
         res = self.client().delete("/questions/9999")
         self.assertEqual(res.status_code, 404)
@@ -103,6 +324,25 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertTrue(data["created"])
 
+    def test_create_question_updates_category_total(self):
+        url = f"/categories/{self.category_id}/questions"
+        before = json.loads(self.client().get(url).data)["total_questions"]
+        self.client().post("/questions", json=self.new_question)
+        data = json.loads(self.client().get(url).data)
+
+        self.assertEqual(data["total_questions"], before + 1)
+
+    def test_new_category_gets_a_counter_without_a_rebuild(self):
+        with self.app.app_context():
+            category = Category(type="Art")
+            category.insert()
+            self.assertEqual(QuestionCount.query.get(str(category.id)).total, 0)
+
+            QuestionCount.query.filter_by(scope=str(category.id)).delete()
+            self.assertEqual(question_count(category.id), 0)
+            # Reads never rebuild the counters.
+            self.assertIsNone(QuestionCount.query.get(str(category.id)))
+
     def test_create_question_400_missing_field(self):
         bad_payload = self.new_question.copy()
         bad_payload.pop("answer")
@@ -119,6 +359,15 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data["questions"]))
         self.assertIn("H2O", data["questions"][0]["question"])
 
+    def test_search_questions_past_last_page(self):
+        payload = dict(self.search_payload, page=9999)
+        res = self.client().post("/questions", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["questions"], [])
+        self.assertTrue(data["total_questions"])
+
     # Category based questions
     
     def test_get_questions_by_category_success(self):
@@ -129,6 +378,28 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["current_category"], self.category_id)
         self.assertTrue(data["questions"])
 
+    def test_get_questions_by_category_pages_with_cursor(self):
+        self.client().post("/questions", json=self.new_question)
+        url = f"/categories/{self.category_id}/questions?limit=1"
+        first = json.loads(self.client().get(url).data)
+        second = json.loads(self.client().get(url + "&cursor=" + first["next_cursor"]).data)
+
+        self.assertEqual(len(first["questions"]), 1)
+        self.assertGreater(second["questions"][0]["id"], first["questions"][0]["id"])
+        self.assertEqual(self.client().get(url.replace("limit=1", "limit=0")).status_code, 400)
+
+    def test_category_first_page_survives_writes_elsewhere(self):
+        url = f"/categories/{self.category_id}/questions"
+        self.client().get(url)
+        with self.app.app_context():
+            other = Category(type="Art")
+            other.insert()
+            self.client().post("/questions", json=dict(self.new_question, category=str(other.id)))
+
+        self.assertEqual(self.client().get(url).headers["X-Cache"], "HIT")
+        self.client().post("/questions", json=self.new_question)
+        self.assertEqual(self.client().get(url).headers["X-Cache"], "MISS")
+
     def test_get_questions_by_category_404(self):
         res = self.client().get("/categories/99/questions")
         self.assertEqual(res.status_code, 404)
@@ -147,6 +418,297 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertTrue(data["question"])
 
+    def test_play_quiz_by_difficulty_and_ramp(self):
+        quiz = {"previous_questions": [], "quiz_category": {"id": str(self.category_id)}}
+        self.client().post("/quizzes", json=quiz)  # builds the index before the writes below
+        self.client().post("/questions", json=self.new_question)
+        self.client().post("/questions", json=dict(self.new_question, difficulty=3))
+
+        data = json.loads(self.client().post("/quizzes", json=dict(quiz, count=5, difficulty=[2, 3])).data)
+        self.assertTrue(data["questions"])
+        self.assertTrue(all(question["difficulty"] in (2, 3) for question in data["questions"]))
+
+        data = json.loads(self.client().post("/quizzes", json=dict(quiz, count=3, difficulty=[1, 3], ramp=True)).data)
+        self.assertEqual([question["difficulty"] for question in data["questions"]], [1, 2, 3])
+
+        res = self.client().post("/quizzes", json=dict(quiz, difficulty=[3, 1]))
+        self.assertEqual(res.status_code, 400)
+
+    def test_play_quiz_skips_previous_questions(self):
+        payload = {
+            "previous_questions": [self.question_id],
+            "quiz_category": {"type": "Science", "id": str(self.category_id)},
+        }
+        res = self.client().post("/quizzes", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(data["question"])
+
+    def test_play_quiz_batch_returns_distinct_questions(self):
+        with self.app.app_context():
+            for i in range(5):
+                self.db.session.add(Question(question=f"Batch {i}?", answer="Yes",
+                                             category=str(self.category_id), difficulty=1))
+            self.db.session.commit()
+
+        payload = {
+            "previous_questions": [self.question_id],
+            "quiz_category": {"type": "Science", "id": str(self.category_id)},
+            "count": 10,
+        }
+        res = self.client().post("/quizzes", json=payload)
+        data = json.loads(res.data)
+        ids = [question["id"] for question in data["questions"]]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(len(ids), 5)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertNotIn(self.question_id, ids)
+
+    def test_play_quiz_batch_400_bad_count(self):
+        res = self.client().post("/quizzes", json={"previous_questions": [], "count": 0})
+        self.assertEqual(res.status_code, 400)
+
+    def test_play_quiz_session_deals_each_question_once(self):
+        res = self.client().post("/quizzes/sessions",
+                                 json={"quiz_category": {"type": "Science", "id": str(self.category_id)}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+
+        seen = []
+        for _ in range(data["total_questions"]):
+            round_data = json.loads(self.client().post("/quizzes", json={"session": data["session"]}).data)
+            seen.append(round_data["question"]["id"])
+        last = json.loads(self.client().post("/quizzes", json={"session": data["session"]}).data)
+
+        self.assertIn(self.question_id, seen)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertIsNone(last["question"])
+
+    def test_quiz_session_deck_is_capped_and_packed(self):
+        app = create_app({"QUIZ_SESSION_MAX_QUESTIONS": 2})
+        with self.app.app_context():
+            for i in range(3):
+                Question(f"Capped {i}?", "Yes", self.category_id, 1).insert()
+        res = app.test_client().post("/quizzes/sessions", json={"quiz_category": {"id": str(self.category_id)}})
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total_questions"], 2)
+        deck = app.extensions["quiz_sessions"].backend.get(f"quiz:{data['session']}")
+        self.assertEqual(len(deck), 4 + 2 * 4)
+
+    def test_play_quiz_unknown_session_404(self):
+        res = self.client().post("/quizzes", json={"session": "no-such-session"})
+        self.assertEqual(res.status_code, 404)
+
+    def asgi_request(self, method, path, body=b"", query=b""):
+        sent = []
+        incoming = [{"type": "http.request", "body": body[:5], "more_body": True},
+                    {"type": "http.request", "body": body[5:], "more_body": False}]
+
+        async def receive():
+            return incoming.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "http_version": "1.1", "method": method, "path": path, "query_string": query,
+                 "headers": [(b"content-type", b"application/json"),
+                             (b"content-length", str(len(body)).encode())]}
+        asyncio.run(PooledWsgiToAsgi(self.app, threads=2)(scope, receive, send))
+        return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+    def test_asgi_serves_the_same_routes(self):
+        status, body = self.asgi_request("GET", "/questions", query=b"page=1")
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)["questions"])
+
+        payload = json.dumps({"previous_questions": [], "count": 2}).encode()
+        status, body = self.asgi_request("POST", "/quizzes", payload)
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)["questions"])
+
+    def test_asgi_runs_requests_in_parallel(self):
+        # Both requests must be inside the app at once to get past the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wsgi_app(environ, start_response):
+            barrier.wait()
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"ok"]
+
+        async def request(asgi_app):
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            async def send(message):
+                sent.append(message)
+
+            await asgi_app({"type": "http", "http_version": "1.1", "method": "GET",
+                            "path": "/", "query_string": b"", "headers": []}, receive, send)
+            return sent[0]["status"]
+
+        async def both():
+            asgi_app = PooledWsgiToAsgi(wsgi_app, threads=2)
+            return await asyncio.gather(request(asgi_app), request(asgi_app))
+
+        self.assertEqual(asyncio.run(both()), [200, 200])
+
+    def test_skipping_schema_checks_boots_without_the_database(self):
+        connects = []
+        listener = lambda dbapi_connection, record: connects.append(record)
+        event.listen(Pool, "connect", listener)
+        try:
+            app = create_app({"SKIP_SCHEMA_CHECKS": True, "SEARCH_BACKEND": "ngram"})
+        finally:
+            event.remove(Pool, "connect", listener)
+        self.assertEqual(connects, [])
+        self.assertIn("create_app_seconds", app.extensions["boot"])
+
+        # The trigram index is built by the first search instead.
+        self.assertFalse(app.extensions["search"].built)
+        res = app.test_client().post("/questions", json={"searchTerm": "h2o"})
+        self.assertTrue(json.loads(res.data)["questions"])
+        self.assertTrue(app.extensions["search"].built)
+
+        result = app.test_cli_runner().invoke(args=["db-init"])
+        self.assertIn("Schema ready.", result.output)
+
+    def test_workers_share_the_default_cache(self):
+        path = urlparse(default_cache_url(2, self.app.config["SQLALCHEMY_DATABASE_URI"])).path
+        shutil.rmtree(path, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, path, True)
+        config = {"WEB_CONCURRENCY": 2, "CACHE_URL": ""}
+        worker_a, worker_b = create_app(config), create_app(config)
+        self.assertEqual(worker_b.config["CACHE_URL"], "shm://" + path)
+
+        worker_a.test_client().post("/questions", json=self.new_question)
+        url = f"/categories/{self.category_id}/questions"
+        listed = lambda: [question["id"] for question in
+                          json.loads(worker_b.test_client().get(url).data)["questions"]]
+        self.assertIn(self.question_id, listed())
+        self.assertEqual(worker_b.test_client().get(url).headers["X-Cache"], "HIT")
+
+        worker_a.test_client().delete(f"/questions/{self.question_id}")
+        self.assertNotIn(self.question_id, listed())
+
+    def test_quiz_index_picks_up_other_workers_writes(self):
+        path = urlparse(default_cache_url(2, self.app.config["SQLALCHEMY_DATABASE_URI"])).path
+        shutil.rmtree(path, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, path, True)
+        config = {"WEB_CONCURRENCY": 2, "CACHE_URL": ""}
+        worker_a, worker_b = create_app(config), create_app(config)
+        quiz = {"previous_questions": [], "quiz_category": {"id": str(self.category_id)}, "count": 50}
+        drawn = lambda app: {question["id"] for question in
+                             json.loads(app.test_client().post("/quizzes", json=quiz).data)["questions"]}
+        drawn(worker_a), drawn(worker_b)
+
+        buckets = worker_a.extensions["question_index"]._buckets
+        res = worker_a.test_client().post("/questions", json=self.new_question)
+        created = json.loads(res.data)["created"]
+        self.assertIn(created, drawn(worker_a))
+        # Its own write was applied in place, not by a rescan.
+        self.assertIs(worker_a.extensions["question_index"]._buckets, buckets)
+        self.assertIn(created, drawn(worker_b))
+
+        worker_b.test_client().delete(f"/questions/{created}")
+        self.assertNotIn(created, drawn(worker_a))
+
+    def test_ngram_index_picks_up_other_workers_writes(self):
+        config = {"SKIP_SCHEMA_CHECKS": True, "SEARCH_BACKEND": "ngram"}
+        worker_a = create_app(config)
+        worker_b = create_app(dict(config, SEARCH_NGRAM_MAX_AGE=0))
+        search = lambda app: json.loads(app.test_client().post(
+            "/questions", json={"searchTerm": "zymurgy"}).data)["total_questions"]
+        self.assertEqual(search(worker_a), 0)
+        self.assertEqual(search(worker_b), 0)
+
+        res = worker_a.test_client().post("/questions", json=dict(
+            self.new_question, question="Is zymurgy the study of fermentation?"))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(search(worker_a), 1)
+        self.assertEqual(search(worker_b), 1)
+
+    def test_reads_go_to_replica_until_the_client_writes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        replica = create_engine(f"sqlite:///{directory.name}/replica.db")
+        Question.metadata.create_all(replica)
+        with replica.begin() as conn:
+            conn.execute(Category.__table__.insert().values(id=self.category_id, type="Science"))
+            conn.execute(Question.__table__.insert().values(
+                question="Only on the replica?", answer="Yes", category=self.category_id, difficulty=1))
+        app = create_app({"DATABASE_REPLICA_URLS": f"sqlite:///{directory.name}/replica.db, "
+                                                   f"sqlite:///{directory.name}/missing/down.db"})
+        client = app.test_client()
+
+        def listed():
+            # Past the first page, which is cached and so always read from the primary.
+            url = f"/categories/{self.category_id}/questions?cursor={pagination.encode_cursor(0)}"
+            return [question["question"] for question in json.loads(client.get(url).data)["questions"]]
+
+        self.assertEqual(listed(), ["Only on the replica?"])
+        self.assertEqual(listed(), ["Only on the replica?"])  # the down replica is skipped
+        self.assertEqual([replica["healthy"] for replica in app.extensions["replicas"].stats()],
+                         [True, False])
+
+        res = client.post("/questions", json=self.new_question)
+        self.assertIn("qm_primary=", res.headers["Set-Cookie"])
+        self.assertIn("Who invented Python?", listed())
+
+    def test_quiz_index_is_built_from_the_primary(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        replica = create_engine(f"sqlite:///{directory.name}/replica.db")
+        Question.metadata.create_all(replica)
+        with replica.begin() as conn:
+            conn.execute(Category.__table__.insert().values(id=self.category_id, type="Science"))
+            conn.execute(Question.__table__.insert().values(
+                id=999999, question="Only on the replica?", answer="Yes", category=self.category_id, difficulty=1))
+        app = create_app({"DATABASE_REPLICA_URLS": f"sqlite:///{directory.name}/replica.db"})
+        with self.app.app_context():
+            primary_ids = {question.id for question in Question.query}
+        res = app.test_client().post("/quizzes", json={"previous_questions": [], "count": 50})
+        # Drawn from the primary's ids, and not dropped for missing on the replica.
+        drawn = {question["id"] for question in json.loads(res.data)["questions"]}
+        self.assertEqual(len(drawn), min(50, len(primary_ids)))
+        self.assertLessEqual(drawn, primary_ids)
+        with app.app_context():
+            self.assertEqual(set(app.extensions["question_index"].ids()), primary_ids)
+
+    def test_stale_replica_never_fills_the_cache_or_the_counters(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        replica = create_engine(f"sqlite:///{directory.name}/replica.db")
+        Question.metadata.create_all(replica)
+        with self.app.app_context(), replica.begin() as conn:
+            Question("Still here?", "Yes", self.category_id, 1).insert()
+            # A copy of the primary as it is before the delete below.
+            for table in (Category.__table__, Question.__table__, QuestionCount.__table__):
+                rows = [dict(row) for row in self.db.session.execute(table.select())]
+                if rows:
+                    conn.execute(table.insert(), rows)
+        app = create_app({"DATABASE_REPLICA_URLS": f"sqlite:///{directory.name}/replica.db"})
+        writer, reader = app.test_client(), app.test_client()
+        url = f"/questions?cursor={pagination.encode_cursor(self.question_id - 1)}"
+
+        def ids(client):
+            res = client.get(url)
+            return res.headers["X-Cache"], [question["id"] for question in json.loads(res.data)["questions"]]
+
+        self.assertIn(self.question_id, ids(reader)[1])
+        writer.delete(f"/questions/{self.question_id}")
+
+        status, listed = ids(reader)
+        self.assertEqual(status, "MISS")
+        self.assertNotIn(self.question_id, listed)
+        self.assertEqual(ids(writer), ("HIT", listed))
+        with app.app_context():
+            self.assertEqual(question_count(), Question.query.count())
+
     def test_play_quiz_400_missing_previous(self):
         payload = {
             # missing "previous_questions"
@@ -155,6 +717,267 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post("/quizzes", json=payload)
         self.assertEqual(res.status_code, 400)
 
+class SerializationTestCase(unittest.TestCase):
+    """Response encoding and the read-only question records"""
+
+    def test_dumps_is_compact_with_sorted_keys(self):
+        self.assertEqual(serialization.dumps({"b": [1, None], "a": "x"}), b'{"a":"x","b":[1,null]}')
+
+    def test_question_record_matches_format(self):
+        question = Question(question="Q?", answer="A", category="3", difficulty=2)
+        question.id = 7
+        record = repository.QuestionRecord(7, "Q?", "A", 3, 2)
+
+        self.assertEqual(record.format(), question.format())
+
+class SlowRequestProfilerTestCase(unittest.TestCase):
+    """Folded stacks for slow requests"""
+
+    def test_slow_request_is_written_as_folded_stacks(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiler = SlowRequestProfiler(directory.name, threshold=0.01, interval=0.001)
+
+        profiler.start_request()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        profiler.finish_request("GET /questions", 0.05)
+
+        [name] = os.listdir(directory.name)
+        with open(os.path.join(directory.name, name)) as f:
+            lines = f.read().splitlines()
+        self.assertIn("GET_questions", name)
+        self.assertTrue(lines)
+        self.assertIn("test_slow_request_is_written_as_folded_stacks", lines[0])
+
+class TrigramIndexTestCase(unittest.TestCase):
+    """In-memory trigram index behind SEARCH_BACKEND=ngram"""
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.build([(1, "What is H2O commonly known as?"),
+                          (2, "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?"),
+                          (3, "What movie earned Tom Hanks his third Oscar nomination?")])
+
+    def test_search_matches_substrings_case_insensitively(self):
+        self.assertEqual(self.index.search("TITLE"), [2])
+        self.assertEqual(self.index.search("what"), [1, 3])
+        self.assertEqual(self.index.search("h2"), [1])
+
+    def test_updates_are_searchable(self):
+        self.index.add(4, "Which title fits?")
+        self.index.replace(2, "Nothing to see")
+        self.index.remove(3)
+
+        self.assertEqual(self.index.search("title"), [4])
+        self.assertEqual(self.index.search("oscar"), [])
+
+    def test_build_over_budget_raises(self):
+        with self.assertRaises(MemoryBudgetExceeded):
+            TrigramIndex(max_bytes=100).build([(1, "What is H2O commonly known as?")])
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of a Redis server for RedisCacheBackend, kept in a dict."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RedisStandInHandler)
+        self.store = {}
+
+
+class RedisStandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].upper()
+
+            if command == b"GET":
+                value = store.get(args[1])
+                reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            elif command == b"GETRANGE":
+                value = store.get(args[1], b"")[int(args[2]):int(args[3]) + 1]
+                reply = b"$%d\r\n%s\r\n" % (len(value), value)
+            elif command == b"SET":
+                store[args[1]] = args[2]
+                reply = b"+OK\r\n"
+            elif command == b"INCR":
+                store[args[1]] = b"%d" % (int(store.get(args[1], b"0")) + 1)
+                reply = b":%s\r\n" % store[args[1]]
+            elif command == b"DEL":
+                reply = b":%d\r\n" % (store.pop(args[1], None) is not None)
+            else:
+                reply = b"+OK\r\n"
+            self.wfile.write(reply)
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    """Cache backends shared between gunicorn workers"""
+
+    def test_local_incr_is_counted_and_evicts(self):
+        backend = LocalCacheBackend(max_bytes=7)
+        backend.set("page", b"1234567")
+        for _ in range(5):
+            backend.incr("position")
+
+        self.assertEqual(backend.stats()["bytes"], 1)
+        self.assertIsNone(backend.get("page"))
+
+    def test_local_sessions_are_never_evicted(self):
+        backend = LocalCacheBackend(max_bytes=8, evict=False)
+        backend.set("deck", b"1234567", ttl=60)
+        with self.assertRaises(CacheFull):
+            backend.set("other", b"12")
+        self.assertEqual(backend.get("deck"), b"1234567")
+
+        backend.set("deck", b"123", ttl=-1)  # expired; swept to make room
+        backend.set("other", b"12345678")
+        self.assertEqual(backend.get("other"), b"12345678")
+
+    def test_shm_backends_share_values_and_versions(self):
+        with tempfile.TemporaryDirectory() as path:
+            worker_a = SharedMemoryCacheBackend(path)
+            worker_b = SharedMemoryCacheBackend(path)
+
+            worker_a.set("key", b"value", ttl=60)
+            worker_a.bump("data")
+
+            self.assertEqual(worker_b.get("key"), b"value")
+            self.assertEqual(worker_b.getrange("key", 1, 3), b"alu")
+            self.assertEqual(worker_b.version("data"), 1)
+            self.assertEqual(worker_b.incr("counter"), 1)
+            self.assertEqual(worker_a.incr("counter"), 2)
+
+    def test_redis_backend_against_stand_in(self):
+        server = RedisStandIn()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        backend = RedisCacheBackend("127.0.0.1", server.server_address[1])
+
+        backend.set("key", b"value", ttl=60)
+        self.assertEqual(backend.get("key"), b"value")
+        self.assertEqual(backend.getrange("key", 1, 3), b"alu")
+        self.assertIsNone(backend.get("missing"))
+        self.assertEqual(backend.version("data"), 0)
+        self.assertEqual(backend.bump("data"), 1)
+        self.assertEqual(backend.version("data"), 1)
+
+class PoolTestCase(unittest.TestCase):
+    """Connection pool options and checkout metrics"""
+
+    def test_engine_options_from_environment(self):
+        options = engine_options("postgresql://localhost/trivia",
+                                 {"DB_POOL_SIZE": "3", "DB_POOL_PRE_PING": "false"})
+
+        self.assertIs(options["poolclass"], InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 3)
+        self.assertFalse(options["pool_pre_ping"])
+        self.assertEqual(engine_options("sqlite:///trivia.db", {}), {})
+
+    def test_setup_db_recomputes_options_for_a_new_url(self):
+        app = Flask("trivia")
+        setup_db(app, "postgresql://localhost/trivia", create_schema=False)
+        self.assertIs(app.config["SQLALCHEMY_ENGINE_OPTIONS"]["poolclass"], InstrumentedQueuePool)
+        setup_db(app, "sqlite://", create_schema=False)
+        self.assertEqual(app.config["SQLALCHEMY_ENGINE_OPTIONS"], {})
+
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = explicit = {"pool_recycle": 60}
+        setup_db(app, "postgresql://localhost/trivia", create_schema=False)
+        self.assertIs(app.config["SQLALCHEMY_ENGINE_OPTIONS"], explicit)
+
+    def test_checkout_waits_are_recorded(self):
+        engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool, pool_size=2)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            stats = pool_stats(engine)
+
+        self.assertEqual(stats["in_use"], 1)
+        self.assertEqual(stats["checkout_wait_seconds"]["count"], 1)
+        self.assertEqual(pool_stats(engine)["idle"], 1)
+
+class MigrationTestCase(unittest.TestCase):
+    """Schema migrations on a copy of the pre-migration schema"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = create_engine(f"sqlite:///{directory.name}/trivia.db")
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR)"))
+            conn.execute(text("CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, "
+                              "answer VARCHAR, category VARCHAR, difficulty INTEGER)"))
+            conn.execute(text("INSERT INTO categories (type) VALUES ('Science'), ('Art')"))
+            conn.execute(text("INSERT INTO questions (question, answer, category, difficulty) "
+                              "VALUES ('Q1', 'A1', '1', 1), ('Q2', 'A2', 'Art', 2), ('Q3', 'A3', '2', 3)"))
+
+    def categories(self):
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT category FROM questions ORDER BY id")).fetchall()
+
+    def test_upgrade_converts_category_to_integer(self):
+        migrations.upgrade(self.engine, batch_size=2, echo=lambda message: None)
+
+        self.assertEqual(migrations.current_version(self.engine), 1)
+        self.assertEqual(self.categories(), [(1,), (2,), (2,)])
+
+    def test_upgrade_recounts_categories_stored_by_name(self):
+        QuestionCount.__table__.create(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("INSERT INTO question_counts (scope, total) "
+                              "VALUES ('*', 3), ('1', 1), ('2', 1), ('Art', 1)"))
+        migrations.upgrade(self.engine, batch_size=2, echo=lambda message: None)
+
+        with self.engine.connect() as conn:
+            counts = dict(conn.execute(text("SELECT scope, total FROM question_counts")).fetchall())
+        self.assertEqual(counts, {"*": 3, "1": 1, "2": 2})
+
+    def test_downgrade_restores_strings(self):
+        migrations.upgrade(self.engine, batch_size=2, echo=lambda message: None)
+        migrations.downgrade(self.engine, batch_size=2, echo=lambda message: None)
+
+        self.assertEqual(migrations.current_version(self.engine), 0)
+        self.assertEqual(self.categories(), [("1",), ("2",), ("2",)])
+
+    def test_round_trip_on_a_models_created_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        engine = create_engine(f"sqlite:///{directory.name}/models.db")
+        Question.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text(SQLITE_FTS_TABLE))
+            for statement in SQLITE_FTS_TRIGGERS:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO categories (type) VALUES ('Science')"))
+            conn.execute(text("INSERT INTO questions (question, answer, category, difficulty) "
+                              "VALUES ('Q1', 'A1', 1, 1), ('Q2', 'A2', 1, 2)"))
+        quiet = lambda message: None
+
+        migrations.upgrade(engine, batch_size=1, echo=quiet)
+        migrations.downgrade(engine, batch_size=1, echo=quiet)
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT category FROM questions ORDER BY id")).fetchall(),
+                             [("1",), ("1",)])
+        migrations.CategoryForeignKey().downgrade(engine, 1, quiet)  # already done: a no-op
+
+        migrations.upgrade(engine, batch_size=1, echo=quiet)
+        with engine.begin() as conn:
+            self.assertEqual(conn.execute(text("SELECT category FROM questions ORDER BY id")).fetchall(),
+                             [(1,), (1,)])
+            # The search triggers survived the table rebuild.
+            conn.execute(text("INSERT INTO questions (question, answer, category, difficulty) "
+                              "VALUES ('Zebra?', 'A3', 1, 1)"))
+            self.assertEqual(conn.execute(text(
+                "SELECT count(*) FROM questions_fts WHERE questions_fts MATCH 'zebra'")).scalar(), 1)
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -13,6 +13,7 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      searchTerm: null,
     };
   }
 
@@ -30,6 +31,7 @@ class QuestionView extends Component {
           totalQuestions: result.total_questions,
           categories: result.categories,
           currentCategory: result.current_category,
+          searchTerm: null,
         });
         return;
       },
@@ -41,7 +43,16 @@ class QuestionView extends Component {
   };
 
   selectPage(num) {
-    this.setState({ page: num }, () => this.getQuestions());
+    const { currentCategory, searchTerm } = this.state;
+    this.setState({ page: num }, () => {
+      if (searchTerm) {
+        this.submitSearch(searchTerm, num);
+      } else if (currentCategory) {
+        this.getByCategory(currentCategory, num);
+      } else {
+        this.getQuestions();
+      }
+    });
   }
 
   createPagination() {
@@ -63,15 +74,17 @@ class QuestionView extends Component {
     return pageNumbers;
   }
 
-  getByCategory = (id) => {
+  getByCategory = (id, page = 1) => {
     $.ajax({
-      url: `/categories/${id}/questions`, //TODO: update request URL
+      url: `/categories/${id}/questions?page=${page}`, //TODO: update request URL
       type: 'GET',
       success: (result) => {
         this.setState({
+          page: page,
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          searchTerm: null,
         });
         return;
       },
@@ -82,22 +95,24 @@ class QuestionView extends Component {
     });
   };
 
-  submitSearch = (searchTerm) => {
+  submitSearch = (searchTerm, page = 1) => {
     $.ajax({
       url: `/questions`, //TODO: update request URL
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({ searchTerm: searchTerm }),
+      data: JSON.stringify({ searchTerm: searchTerm, page: page }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
         this.setState({
+          page: page,
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          searchTerm: searchTerm,
         });
         return;
       },